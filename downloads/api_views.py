@@ -10,7 +10,9 @@ from cloudinary import CloudinaryImage
 
 
 from payments.models import DownloadToken
+from photos.archive import zip_public_id_with_ext
 from .serializers import DownloadTokenSerializer
+from .utils import build_stream_download_url, STREAM_TICKET_MAX_AGE
 
 
 class DownloadTokenAPIView(generics.RetrieveAPIView):
@@ -126,44 +128,42 @@ class InitiateDownloadAPIView(APIView):
                 'is_valid': False
             }, status=status.HTTP_410_GONE)
         
-        # Check if file exists
-        if not download_token.purchase.batch.zip_file:
-            return Response(
-                {'error': 'Download file not available'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+        batch = download_token.purchase.batch
+        mode = request.data.get('mode') or request.query_params.get('mode')
+        volumes = batch.completed_zip_volumes()
+        
+        # A stored ZIP is kept while the batch changes (for incremental
+        # updates), so it can still hold removed photos until it is rebuilt
+        prebuilt = batch.zip_status == 'completed' and (batch.zip_file or volumes)
+        
+        # Stream the ZIP on the fly when asked to, or while no up-to-date prebuilt ZIP exists
+        if mode == 'stream' or not prebuilt:
+            return self.initiate_stream_download(request, download_token, batch)
         
         try:
-            # Get the public ID from the batch
-            public_id = str(download_token.purchase.batch.zip_file)
-            
-            if not public_id.endswith('.zip'):
-                public_id_with_ext = f"{public_id}.zip"
+            # Large batches are split into volumes: one signed URL per volume
+            if volumes:
+                public_ids = [str(volume.zip_file) for volume in volumes]
             else:
-                public_id_with_ext = public_id
+                public_ids = [str(batch.zip_file)]
             
-            zip_image = CloudinaryImage(public_id_with_ext)
-            print(zip_image)
-            print(public_id_with_ext)
-            # cloudinary.utils.cloudinary_url(zip_image, resource_type = "raw")
-            download_url = zip_image.build_url(
-                resource_type='raw',
-                # format='zip',
-                attachment=True,  
-                sign_url=True,
-                expires_at=int(timezone.now().timestamp()) + 300  # 5 minutes
-            )
+            download_urls = [self.build_signed_zip_url(public_id) for public_id in public_ids]
         
             # Increment download count AFTER successful URL generation
             download_token.increment_download()
             
             # Return the download URL
-            return Response({
+            data = {
                 'success': True,
-                'download_url': download_url,
+                'download_url': download_urls[0],
                 'expires_in': 300,  # seconds
                 'downloads_remaining': download_token.max_downloads - download_token.download_count
-            }, status=status.HTTP_200_OK)
+            }
+            if volumes:
+                data['mode'] = 'volumes'
+                data['download_urls'] = download_urls
+            
+            return Response(data, status=status.HTTP_200_OK)
             
         except Exception as e:
             # CHANGE 4: Better error logging for debugging
@@ -178,6 +178,36 @@ class InitiateDownloadAPIView(APIView):
             )
 
 
+    def build_signed_zip_url(self, public_id):
+        """Signed, expiring attachment URL of a stored ZIP"""
+        zip_image = CloudinaryImage(zip_public_id_with_ext(public_id))
+        return zip_image.build_url(
+            resource_type='raw',
+            attachment=True,  
+            sign_url=True,
+            expires_at=int(timezone.now().timestamp()) + 300  # 5 minutes
+        )
+    
+    def initiate_stream_download(self, request, download_token, batch):
+        """Return a short-lived URL that builds the ZIP while sending it"""
+        if not batch.photos.exists():
+            return Response(
+                {'error': 'Download file not available'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Counted by the stream view once it starts sending the ZIP
+        download_url = build_stream_download_url(request, download_token.token)
+        
+        return Response({
+            'success': True,
+            'mode': 'stream',
+            'download_url': download_url,
+            'expires_in': STREAM_TICKET_MAX_AGE,  # seconds
+            'downloads_remaining': download_token.max_downloads - download_token.download_count - 1
+        }, status=status.HTTP_200_OK)
+
+
 class DownloadStatusAPIView(generics.RetrieveAPIView):
     """
     API endpoint to check download status
@@ -5,5 +5,6 @@ app_name = 'downloads'
 
 urlpatterns = [
     path('<str:token>/', views.DownloadPageView.as_view(), name='download-page'),
+    path('<str:token>/stream/', views.StreamDownloadView.as_view(), name='stream-download'),
 ]
 
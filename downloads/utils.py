@@ -1,6 +1,8 @@
+from django.core import signing
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.urls import reverse
 
 from payments.models import DownloadToken
 
@@ -103,5 +105,27 @@ def send_download_email(purchase):
     except Exception as e:
         print(f"Error sending email: {e}")
         return False
-    
 
+
+# Streamed downloads are authorised by a short-lived signed ticket, the same
+# way prebuilt ZIPs are served through an expiring signed Cloudinary URL
+STREAM_TICKET_MAX_AGE = 300  # 5 minutes
+STREAM_TICKET_SALT = 'downloads.stream'
+
+
+def build_stream_download_url(request, token):
+    """Absolute URL that streams the batch ZIP for `token`"""
+    ticket = signing.TimestampSigner(salt=STREAM_TICKET_SALT).sign(str(token))
+    url = reverse('downloads:stream-download', args=[token])
+    return request.build_absolute_uri(f"{url}?ticket={ticket}")
+
+
+def verify_stream_ticket(ticket, token):
+    """Check that `ticket` was issued for `token` and has not expired"""
+    try:
+        value = signing.TimestampSigner(salt=STREAM_TICKET_SALT).unsign(
+            ticket or '', max_age=STREAM_TICKET_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return value == str(token)
@@ -1,9 +1,12 @@
 from django.shortcuts import render, redirect
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.views import View
 from django.conf import settings
+from django.utils.text import slugify
 import requests
 from payments.models import DownloadToken
+from photos.archive import stream_zip
+from .utils import verify_stream_ticket
 
 
 class DownloadPageView(View):
@@ -108,7 +111,8 @@ class DownloadPageView(View):
                 'error': 'Download token has expired or exceeded maximum downloads'
             }, status=410)
         
-        if not download_token.purchase.batch.zip_file:
+        batch = download_token.purchase.batch
+        if not batch.zip_file and not batch.photos.exists():
             return render(request, self.template_name, {
                 'token': download_token,
                 'error': 'Download file not available'
@@ -118,13 +122,25 @@ class DownloadPageView(View):
             # Build the API endpoint URL
             api_url = request.build_absolute_uri(f'/api/downloads/initiate/{token}/')
             
-            # Make POST request to the API
-            response = requests.post(api_url)
+            # Make POST request to the API (?mode=stream skips the prebuilt ZIP)
+            response = requests.post(api_url, data={'mode': request.GET.get('mode')})
             
             # Check if API call was successful
             if response.status_code == 200:
                 data = response.json()
                 download_url = data.get('download_url')
+                download_urls = data.get('download_urls') or []
+                
+                # Split ZIPs can't be served with one redirect: list the volumes
+                if len(download_urls) > 1:
+                    download_token.refresh_from_db()
+                    return render(request, self.template_name, {
+                        'token': download_token,
+                        'remaining_downloads': data.get('downloads_remaining'),
+                        'purchase': download_token.purchase,
+                        'batch': download_token.purchase.batch,
+                        'download_urls': download_urls,
+                    })
                 
                 if download_url:
                     # Redirect to the Cloudinary download URL
@@ -169,3 +185,49 @@ class DownloadPageView(View):
                 'error': 'Download temporarily unavailable',
                 'detail': str(e)
             }, status=503)
+
+
+class StreamDownloadView(View):
+    """
+    Streams the batch ZIP while it is being built, so customers can download
+    before (or without) a prebuilt archive. Reached through the short-lived
+    URL returned by the initiate download API; the download is counted here,
+    once the ZIP can be served.
+    
+    Streams last as long as the transfer, so the web service runs threaded
+    gunicorn workers (see railway.toml).
+    """
+    expired_template_name = 'downloads/expired.html'
+    
+    def get(self, request, token):
+        try:
+            download_token = DownloadToken.objects.select_related('purchase__batch').get(token=token)
+        except DownloadToken.DoesNotExist:
+            raise Http404("Invalid download token")
+        
+        if not verify_stream_ticket(request.GET.get('ticket'), download_token.token):
+            return render(request, self.expired_template_name, {
+                'token': download_token,
+                'error': 'This download link has expired. Please start the download again.'
+            }, status=410)
+        
+        batch = download_token.purchase.batch
+        photos = batch.photos.only('id', 'original_image', 'original_version', 'batch_id')
+        photos = [photo for photo in photos if photo.original_image]
+        if not photos:
+            raise Http404("Download file not available")
+        
+        if not download_token.is_valid():
+            return render(request, self.expired_template_name, {
+                'token': download_token,
+                'error': 'Download token has expired or exceeded maximum downloads'
+            }, status=410)
+        download_token.increment_download()
+        
+        response = StreamingHttpResponse(
+            stream_zip(photos, concurrency=settings.ZIP_STREAM_FETCH_CONCURRENCY),
+            content_type='application/zip'
+        )
+        filename = f"{slugify(batch.title) or batch.id}.zip"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,27 @@
+"""Pipeline counters kept in the shared (Redis) cache"""
+from django.core.cache import cache
+
+
+METRIC_KEY_PREFIX = 'metrics'
+
+
+def _key(name):
+    return f'{METRIC_KEY_PREFIX}:{name}'
+
+
+def incr_metric(name, amount=1):
+    """Increment a counter shared by every web and worker process"""
+    key = _key(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        # Evicted between add and incr
+        cache.set(key, amount, timeout=None)
+        return amount
+
+
+def get_metrics(*names):
+    """Current value of each named counter (0 if never incremented)"""
+    values = cache.get_many([_key(name) for name in names])
+    return {name: values.get(_key(name), 0) for name in names}
@@ -1,11 +1,41 @@
 """Monitoring utilities for production"""
 from django.core.cache import cache
+from kombu.exceptions import ChannelError
 from photos.models import Batch, Photo
+from photos.originals_cache import originals_cache_stats
+from photos.reaper import expired_batches, expired_photos
+from photos.routing import DEFAULT_QUEUE, QUEUES
+from .metrics import get_metrics
 import logging
 
 logger = logging.getLogger('photos')
 
 
+def get_queue_depth(queue=DEFAULT_QUEUE):
+    """
+    Number of messages waiting in a Celery queue, or None if the broker
+    cannot be reached.
+    """
+    from photobiz.celery import app
+    
+    try:
+        with app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            declared = connection.default_channel.queue_declare(queue=queue, passive=True)
+            return declared.message_count
+    except ChannelError:
+        # The Redis transport drops a queue's key once it is empty
+        return 0
+    except Exception as e:
+        logger.warning(f'Could not read depth of queue {queue}: {e}')
+        return None
+
+
+def get_queue_depths():
+    """Depth of every pipeline queue (None where it could not be read)"""
+    return {queue: get_queue_depth(queue) for queue in (DEFAULT_QUEUE,) + QUEUES}
+
+
 def check_processing_health():
     """
     Check the health of photo processing pipeline.
@@ -17,14 +47,11 @@ def check_processing_health():
         'stats': {}
     }
     
-    # Check for stuck processing
-    stuck_photos = Photo.objects.filter(
-        preview_status='processing'
-    ).count()
-    
-    stuck_batches = Batch.objects.filter(
-        zip_status='processing'
-    ).count()
+    # Check for stuck processing: no heartbeat within the lease timeout
+    stuck_photos = expired_photos().count()
+    stuck_batches = expired_batches().count()
+    health['stats']['stuck_previews'] = stuck_photos
+    health['stats']['stuck_zips'] = stuck_batches
     
     if stuck_photos > 10:
         health['status'] = 'degraded'
@@ -53,6 +80,21 @@ def check_processing_health():
     health['stats']['pending_previews'] = pending_photos
     health['stats']['pending_zips'] = pending_batches
     
+    # Background pipeline counters
+    health['stats'].update(get_metrics(
+        'zip_build_duplicates_skipped', 'dead_lettered', 'reclaimed_previews', 'reclaimed_zip_builds',
+        'reclaimed_ingests'
+    ))
+    health['stats'].update(originals_cache_stats())
+    
+    queue_depths = get_queue_depths()
+    for queue, depth in queue_depths.items():
+        health['stats'][f'queue_depth_{queue}'] = depth
+    
+    if (queue_depths.get('heavy') or 0) > 20:
+        health['status'] = 'degraded'
+        health['issues'].append(f"ZIP queue backlog: {queue_depths['heavy']} builds waiting")
+    
     if pending_photos > 100:
         health['status'] = 'degraded'
         health['issues'].append(f'Large pending queue: {pending_photos} photos')
@@ -20,18 +20,20 @@ app.conf.beat_schedule = {
         'task': 'photos.tasks.retry_failed_previews',
         'schedule': crontab(minute=0),  # Every hour
     },
+    'reclaim-stuck-processing': {
+        'task': 'photos.tasks.reclaim_stuck_processing',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
     'cleanup-cache-daily': {
         'task': 'photos.tasks.cleanup_old_cache',
         'schedule': crontab(hour=3, minute=0),  # Daily at 3 AM
     },
 }
 
-# Optional: Task routing for better resource management
-# app.conf.task_routes = {
-#     'photos.tasks.generate_photo_preview': {'queue': 'images'},
-#     'photos.tasks.generate_batch_zip': {'queue': 'heavy'},
-#     'photos.tasks.process_batch_upload': {'queue': 'orchestration'},
-# }
+# Task routing: previews, ZIP builds and orchestration get their own queues
+# so a long ZIP build never holds up previews (see photos/routing.py and the
+# railway.celery-*.toml worker profiles)
+app.conf.task_routes = ('photos.routing.route_task',)
 
 # Performance optimizations
 app.conf.update(
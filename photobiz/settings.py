@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -213,6 +215,8 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+UPLOAD_STAGING_DIR = config('UPLOAD_STAGING_DIR', default='')  # Volume mounted by web and workers alike where 'staged' admin uploads wait for the ingest task; empty configures no staging storage
+
 STORAGES = {
     "default": {
         "BACKEND": "django.core.files.storage.FileSystemStorage",
@@ -222,6 +226,15 @@ STORAGES = {
     }
 }
 
+# Staged uploads are written by the web container and read by the workers,
+# so the staging storage must be shared: a common volume here, or a remote
+# backend such as S3 configured as STORAGES["staging"] instead
+if UPLOAD_STAGING_DIR:
+    STORAGES["staging"] = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": UPLOAD_STAGING_DIR},
+    }
+
 COMPRESS_ROOT = BASE_DIR / 'staticfiles'
 
 COMPRESS_ENABLED = True
@@ -257,6 +270,45 @@ CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://127.0.0
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 
+# Task retries
+TASK_RETRY_BACKOFF_MAX = config('TASK_RETRY_BACKOFF_MAX', default=15 * 60, cast=int)  # Longest delay between two retries, in seconds (jittered below it)
+RETRY_BUDGET_RATE = config('RETRY_BUDGET_RATE', default=10, cast=float)  # Previews per second that retries and admin regenerations may queue
+RETRY_BUDGET_BURST = config('RETRY_BUDGET_BURST', default=100, cast=int)  # Previews they may queue at once before being paced
+RETRY_BUDGET_HORIZON = config('RETRY_BUDGET_HORIZON', default=10 * 60, cast=int)  # Furthest ahead a paced preview message is scheduled, in seconds; keep well below the broker visibility timeout (1 h on Redis)
+DEAD_LETTER_MAX = config('DEAD_LETTER_MAX', default=1000, cast=int)  # Permanently failed tasks kept for inspection
+
+# Processing leases
+PROCESSING_HEARTBEAT_INTERVAL = config('PROCESSING_HEARTBEAT_INTERVAL', default=60, cast=int)  # Seconds between heartbeats of a running preview chunk or ZIP build
+PROCESSING_LEASE_TIMEOUT = config('PROCESSING_LEASE_TIMEOUT', default=10 * 60, cast=int)  # Seconds without heartbeat before 'processing' work is reclaimed
+PROCESSING_REAP_PHOTOS = config('PROCESSING_REAP_PHOTOS', default=200, cast=int)  # Previews requeued per reaper run
+PROCESSING_REAP_BATCHES = config('PROCESSING_REAP_BATCHES', default=10, cast=int)  # ZIP builds requeued per reaper run
+
+# Upload processing
+BATCH_PIPELINE = config('BATCH_PIPELINE', default='sequential')  # 'sequential' (ZIP after all previews) or 'parallel' (ZIP alongside previews)
+
+# ZIP generation
+ZIP_FETCH_CONCURRENCY = config('ZIP_FETCH_CONCURRENCY', default=8, cast=int)  # Originals downloaded at once
+ZIP_UPLOAD_CHUNK_SIZE = config('ZIP_UPLOAD_CHUNK_SIZE', default=20 * 1024 * 1024, cast=int)  # Bytes per chunked upload request (min 5MB)
+ZIP_VOLUME_MAX_BYTES = config('ZIP_VOLUME_MAX_BYTES', default=2 * 1024 ** 3, cast=int)  # Larger batches are split into volumes
+ZIP_REBUILD_QUIET_PERIOD = config('ZIP_REBUILD_QUIET_PERIOD', default=30, cast=int)  # Seconds without changes before a debounced rebuild runs
+ZIP_BUILD_LEASE_TTL = config('ZIP_BUILD_LEASE_TTL', default=120, cast=int)  # Seconds a dead worker keeps a batch locked
+ZIP_STREAM_FETCH_CONCURRENCY = config('ZIP_STREAM_FETCH_CONCURRENCY', default=4, cast=int)  # Per streamed download, on web workers
+
+# Previews
+PREVIEW_BACKEND = config('PREVIEW_BACKEND', default='cloudinary')  # 'cloudinary' (download and re-upload), 'derived' (eager named transformation copied by Cloudinary, no image bytes through workers) or 'local' (Pillow)
+PREVIEW_RENDITION_WIDTHS = config('PREVIEW_RENDITION_WIDTHS', default='160,320,640,800', cast=Csv(int))  # Width ladder rendered by the 'local' backend
+PREVIEW_RENDITION_FORMATS = config('PREVIEW_RENDITION_FORMATS', default='jpeg,webp', cast=Csv())  # Formats rendered for every width (jpeg first)
+PREVIEW_RENDER_PROCESSES = config('PREVIEW_RENDER_PROCESSES', default=os.cpu_count() or 1, cast=int)  # Pillow render processes per worker for the 'local' backend (0 renders inline)
+PREVIEW_TRANSFORMATION = config('PREVIEW_TRANSFORMATION', default='photobiz_preview')  # Named transformation used by the 'derived' backend
+PREVIEW_CONCURRENCY = config('PREVIEW_CONCURRENCY', default=8, cast=int)  # Previews generated at once within a chunk
+PREVIEW_CHUNK_MIN = config('PREVIEW_CHUNK_MIN', default=5, cast=int)  # Photos per preview task message, lower bound
+PREVIEW_CHUNK_MAX = config('PREVIEW_CHUNK_MAX', default=50, cast=int)  # Photos per preview task message, upper bound
+PREVIEW_WORKER_SLOTS = config('PREVIEW_WORKER_SLOTS', default=4, cast=int)  # Worker processes preview chunks are spread over
+
+# Originals cache (local disk, shared by the worker processes of one host)
+ORIGINALS_CACHE_DIR = config('ORIGINALS_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'photobiz-originals'))  # Empty disables the cache
+ORIGINALS_CACHE_MAX_BYTES = config('ORIGINALS_CACHE_MAX_BYTES', default=2 * 1024 ** 3, cast=int)  # LRU eviction above this size
+
 
 # For production with Redis Sentinel
 # CELERY_BROKER_URL = 'sentinel://localhost:26379;sentinel://localhost:26380'
@@ -297,6 +349,20 @@ CLOUDINARY = {
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 26214400  # 25MB
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000  # Prevent DOS
+ADMIN_UPLOAD_MODE = config('ADMIN_UPLOAD_MODE', default='direct')  # 'direct' (uploaded to Cloudinary during the admin request), 'stream' (uploaded while the request arrives, one file at a time) or 'staged' (saved to STORAGES["staging"], uploaded by the ingest task)
+if ADMIN_UPLOAD_MODE == 'staged' and 'staging' not in STORAGES:
+    raise ImproperlyConfigured(
+        "ADMIN_UPLOAD_MODE 'staged' needs a staging storage shared by web and workers: "
+        "set UPLOAD_STAGING_DIR to a shared volume or configure STORAGES['staging']"
+    )
+ADMIN_UPLOAD_CONCURRENCY = config('ADMIN_UPLOAD_CONCURRENCY', default=6, cast=int)  # Originals uploaded to Cloudinary at once from the batch admin or the ingest task
+INGEST_SLICE_SIZE = config('INGEST_SLICE_SIZE', default=24, cast=int)  # Staged files uploaded and recorded as photos per ingest step
+ADMIN_UPLOAD_CHUNK_SIZE = config('ADMIN_UPLOAD_CHUNK_SIZE', default=5 * 1024 * 1024, cast=int)  # Bytes per chunk when batch admin uploads are streamed to Cloudinary (min 5MB); files arrive one after another in the request body, so streamed files are uploaded strictly one at a time with one chunk in flight
+FILE_UPLOAD_HANDLERS = [
+    'photos.upload_handlers.BatchUploadHandler',  # Streams batch admin originals straight to Cloudinary
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
 
 from django.templatetags.static import static
 
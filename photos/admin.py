@@ -1,11 +1,24 @@
+import json
+
 from django.contrib import admin
 from django import forms
+from django.conf import settings
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.utils.html import format_html
-from cloudinary import uploader
+from django.db.models import Count, Q
+from django.http import Http404, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.templatetags.static import static
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 from .models import Batch, Photo
-from .tasks import process_batch_upload
+from .ingest import (
+    MAX_ORIGINAL_BYTES, create_photos, discard_streamed, signed_upload_params, stage_files, staged_files,
+    upload_originals, verified_uploads,
+)
+from .progress import get_batch_progress, start_progress
+from .scheduling import requeue_previews
+from .tasks import ingest_batch_upload, process_batch_upload
 from unfold.admin import ModelAdmin
 from unfold.decorators import display, action
 
@@ -128,7 +141,7 @@ class BatchAdmin(ModelAdmin):
         'zip_status_display',
         'created_at'
     ]
-    list_filter = ['category', 'zip_status', 'created_at']
+    list_filter = ['category', 'zip_status', 'ingest_status', 'created_at']
     search_fields = ['title', 'description']
     readonly_fields = [
         'id', 
@@ -137,22 +150,26 @@ class BatchAdmin(ModelAdmin):
         'zip_file_link',
         'photo_count_display',
         'zip_status_display',
+        'ingest_status_display',
+        'progress_display',
+        'time_to_sell_display',
+        'direct_upload_display',
         'view_photos_link'
     ]
     
-    actions = ['regenerate_zip_files', 'regenerate_all_previews']
+    actions = ['regenerate_zip_files', 'regenerate_all_previews', 'resume_ingest']
     
     fieldsets = (
         ('Batch Information', {
             'fields': ('title', 'description', 'category', 'price')
         }),
         ('Upload Photos', {
-            'fields': ('bulk_upload',),
+            'fields': ('bulk_upload', 'direct_upload_display'),
             'description': (
                 '<strong>Upload Process:</strong><br/>'
-                '1. Photos are uploaded to Cloudinary<br/>'
+                '1. Photos are uploaded to Cloudinary (direct uploads go from your browser straight to Cloudinary)<br/>'
                 '2. Watermarked previews are generated in the background<br/>'
-                '3. A ZIP file is created automatically when all previews are ready<br/>'
+                '3. A ZIP file is created automatically, after the previews or alongside them (BATCH_PIPELINE)<br/>'
                 '<em>You will be notified when uploads complete. Processing continues in the background.</em>'
             )
         }),
@@ -162,6 +179,9 @@ class BatchAdmin(ModelAdmin):
                 'photo_count_display',
                 'view_photos_link',
                 'zip_status_display',
+                'ingest_status_display',
+                'progress_display',
+                'time_to_sell_display',
                 'zip_file_link', 
                 'created_at', 
                 'updated_at'
@@ -188,11 +208,14 @@ class BatchAdmin(ModelAdmin):
         if not obj.id:
             return "-"
         
-        total = obj.photos.count()
-        completed = obj.photos.filter(preview_status='completed').count()
-        pending = obj.photos.filter(preview_status='pending').count()
-        processing = obj.photos.filter(preview_status='processing').count()
-        failed = obj.photos.filter(preview_status='failed').count()
+        # One query for all counts
+        counts = obj.photos.aggregate(
+            total=Count('id'),
+            completed=Count('id', filter=Q(preview_status='completed')),
+            pending=Count('id', filter=Q(preview_status='pending')),
+            processing=Count('id', filter=Q(preview_status='processing')),
+            failed=Count('id', filter=Q(preview_status='failed')),
+        )
         
         return format_html(
             '<strong>Total:</strong> {} | '
@@ -200,7 +223,8 @@ class BatchAdmin(ModelAdmin):
             '<span style="color: #f97316;">⏳ Pending: {}</span> | '
             '<span style="color: #3b82f6;">↻ Processing: {}</span> | '
             '<span style="color: #ef4444;">✗ Failed: {}</span>',
-            total, completed, pending, processing, failed
+            counts['total'], counts['completed'], counts['pending'],
+            counts['processing'], counts['failed']
         )
     
     @display(description='ZIP Status')
@@ -241,9 +265,220 @@ class BatchAdmin(ModelAdmin):
         
         return html
     
+    @display(description='Upload Ingest')
+    def ingest_status_display(self, obj):
+        """Progress of the background upload of staged photos to Cloudinary"""
+        if not obj.ingest_status:
+            return "-"
+        
+        counts = f"{obj.ingest_uploaded} / {obj.ingest_total} uploaded"
+        if obj.ingest_failed:
+            counts += f", {obj.ingest_failed} failed"
+        
+        if obj.ingest_status == 'failed':
+            return format_html(
+                '<span style="color: #ef4444;">✗ {} — {}</span>',
+                counts, obj.ingest_error or 'gave up'
+            )
+        if obj.ingest_status == 'completed':
+            return format_html('<span style="color: #10b981;">✓ {}</span>', counts)
+        return format_html('<em style="color: #f97316;">↻ {}</em>', counts)
+    
+    @display(description='Time to Sell')
+    def time_to_sell_display(self, obj):
+        """How long the latest upload took to become sellable (previews and ZIP done)"""
+        if not obj.processing_started_at:
+            return "-"
+        if obj.time_to_sell is None:
+            return f"In progress ({obj.processing_pipeline} pipeline)"
+        
+        seconds = round(obj.time_to_sell.total_seconds())
+        return f"{seconds // 60}m {seconds % 60}s ({obj.processing_pipeline} pipeline)"
+    
+    @display(description='Live Progress')
+    def progress_display(self, obj):
+        """Progress bars for previews and ZIP, refreshed from the progress endpoint"""
+        if not obj.id:
+            return "-"
+        
+        url = reverse('admin:photos_batch_progress', args=[obj.id])
+        bar = (
+            '<div style="margin-bottom: 8px;">'
+            '<div style="font-size: 13px; margin-bottom: 4px;">{label}: <span data-progress-text="{stage}">-</span></div>'
+            '<div style="background: #374151; border-radius: 4px; height: 8px; width: 320px; overflow: hidden;">'
+            '<div data-progress-bar="{stage}" style="background: linear-gradient(135deg, #f97316, #fb923c); height: 8px; width: 0;"></div>'
+            '</div></div>'
+        )
+        
+        return format_html(
+            '<div id="batch-progress">{}{}</div>'
+            '<script>'
+            '(function() {{'
+            '  var root = document.getElementById("batch-progress");'
+            '  function eta(seconds) {{'
+            '    if (seconds === null) return "estimating...";'
+            '    if (seconds < 60) return seconds + "s left";'
+            '    return Math.round(seconds / 60) + " min left";'
+            '  }}'
+            '  function poll() {{'
+            '    fetch("{}", {{credentials: "same-origin"}}).then(function(r) {{ return r.json(); }}).then(function(data) {{'
+            '      var active = false;'
+            '      Object.keys(data.progress).forEach(function(stage) {{'
+            '        var p = data.progress[stage];'
+            '        var text = root.querySelector("[data-progress-text=" + stage + "]");'
+            '        var bar = root.querySelector("[data-progress-bar=" + stage + "]");'
+            '        if (!p) {{ text.textContent = "no recent run"; return; }}'
+            '        bar.style.width = p.percent + "%";'
+            '        var mb = (p.bytes / 1048576).toFixed(1);'
+            '        text.textContent = p.done + " / " + p.total + " (" + p.percent + "%, " + mb + " MB)"'
+            '          + (p.done < p.total ? ", " + eta(p.eta_seconds) : "");'
+            '        if (p.done < p.total) active = true;'
+            '      }});'
+            '      if (active || data.zip_status === "pending" || data.zip_status === "processing") {{'
+            '        setTimeout(poll, 3000);'
+            '      }}'
+            '    }});'
+            '  }}'
+            '  poll();'
+            '}})();'
+            '</script>',
+            format_html(bar, label='Previews', stage='previews'),
+            format_html(bar, label='ZIP', stage='zip'),
+            url
+        )
+    
+    @display(description='Direct Upload')
+    def direct_upload_display(self, obj):
+        """File picker that uploads from the browser straight to Cloudinary"""
+        if not obj.id:
+            return "Save the batch first to upload directly"
+        
+        return format_html(
+            '<div data-direct-upload data-signature-url="{}" data-register-url="{}" '
+            'data-max-bytes="{}" data-concurrency="{}">'
+            '<input type="file" accept="image/*" multiple> '
+            '<button type="button" class="button">⬆ Upload directly</button> '
+            '<span data-upload-status style="margin-left: 10px; color: #666; font-size: 13px;"></span>'
+            '</div>'
+            '<script src="{}"></script>',
+            reverse('admin:photos_batch_upload_signature', args=[obj.id]),
+            reverse('admin:photos_batch_register_uploads', args=[obj.id]),
+            MAX_ORIGINAL_BYTES,
+            settings.ADMIN_UPLOAD_CONCURRENCY,
+            static('js/direct_upload.js')
+        )
+    
+    def get_urls(self):
+        urls = [
+            path(
+                '<path:object_id>/progress/',
+                self.admin_site.admin_view(self.progress_view),
+                name='photos_batch_progress'
+            ),
+            path(
+                '<path:object_id>/upload-signature/',
+                self.admin_site.admin_view(self.upload_signature_view),
+                name='photos_batch_upload_signature'
+            ),
+            path(
+                '<path:object_id>/register-uploads/',
+                self.admin_site.admin_view(self.register_uploads_view),
+                name='photos_batch_register_uploads'
+            ),
+        ]
+        return urls + super().get_urls()
+    
+    def progress_view(self, request, object_id):
+        """
+        JSON snapshot of a batch's pipeline progress. Served from the cache
+        plus a single-column lookup, so polling it is cheap.
+        """
+        if not self.has_view_permission(request):
+            raise Http404
+        
+        try:
+            zip_status = Batch.objects.filter(id=object_id).values_list('zip_status', flat=True).first()
+        except ValidationError:
+            zip_status = None
+        if zip_status is None:
+            raise Http404
+        
+        return JsonResponse({
+            'zip_status': zip_status,
+            'progress': get_batch_progress(object_id),
+        })
+    
+    def _get_batch_for_upload(self, request, object_id):
+        if not self.has_change_permission(request):
+            raise Http404
+        try:
+            batch = Batch.objects.only('id', 'title').filter(id=object_id).first()
+        except ValidationError:
+            batch = None
+        if batch is None:
+            raise Http404
+        return batch
+    
+    def upload_signature_view(self, request, object_id):
+        """Signed parameters for one direct browser upload to the batch's originals"""
+        batch = self._get_batch_for_upload(request, object_id)
+        url, fields = signed_upload_params(batch.id)
+        return JsonResponse({'url': url, 'fields': fields})
+    
+    def register_uploads_view(self, request, object_id):
+        """
+        Record the originals a browser uploaded directly as photos (in bulk)
+        and queue their processing. Expects a JSON body of the form
+        {"uploads": [{"public_id", "version", "signature", "bytes"}, ...]}
+        taken from Cloudinary's upload responses.
+        """
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        batch = self._get_batch_for_upload(request, object_id)
+        
+        try:
+            uploads = json.loads(request.body)['uploads']
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest('Expected a JSON body with an "uploads" list')
+        if not isinstance(uploads, list):
+            return HttpResponseBadRequest('Expected a JSON body with an "uploads" list')
+        
+        upload_results, rejected = verified_uploads(batch.id, uploads)
+        photo_ids = [str(photo.id) for photo in create_photos(batch.id, upload_results)]
+        
+        task_id = None
+        if photo_ids:
+            task_id = process_batch_upload.delay(str(batch.id), photo_ids).id
+            messages.success(
+                request,
+                f"✓ Successfully uploaded {len(photo_ids)} photo(s) to batch '{batch.title}'. "
+                f"Preview generation and ZIP creation are running in the background."
+            )
+        if rejected:
+            messages.warning(request, f"{rejected} upload(s) could not be verified and were ignored")
+        
+        return JsonResponse({
+            'status': 'queued' if photo_ids else 'empty',
+            'registered': len(photo_ids),
+            'rejected': rejected,
+            'task_id': task_id,
+        })
+    
     @display(description='ZIP File')
     def zip_file_link(self, obj):
         """Display a clickable link to the ZIP file if it exists"""
+        volumes = obj.completed_zip_volumes() if obj and obj.id else []
+        if volumes:
+            from cloudinary import CloudinaryImage
+            return format_html_join(
+                ' ',
+                '<a href="{}" target="_blank" class="button" style="display: inline-block; padding: 8px 16px; margin: 2px; background: linear-gradient(135deg, #f97316, #fb923c); color: white; text-decoration: none; border-radius: 6px; font-weight: 500;">⬇ Part {} of {}</a>',
+                (
+                    (CloudinaryImage(str(volume.zip_file)).build_url(resource_type='raw'), volume.index + 1, len(volumes))
+                    for volume in volumes
+                )
+            )
+        
         if obj and obj.zip_file:
             try:
                 from cloudinary import CloudinaryImage
@@ -275,19 +510,20 @@ class BatchAdmin(ModelAdmin):
         
         self.message_user(
             request,
-            f"✓ Queued ZIP regeneration for {count} batch(es).",
+            f"✓ Queued ZIP regeneration for {count} batch(es). "
+            f"Builds start once a batch has had no changes for {settings.ZIP_REBUILD_QUIET_PERIOD}s.",
             messages.SUCCESS
         )
     
     @action(description='Regenerate all previews')
     def regenerate_all_previews(self, request, queryset):
         """Admin action to regenerate all previews for selected batches"""
-        total_photos = 0
-        for batch in queryset:
-            photos = batch.photos.all()
-            for photo in photos:
-                photo.schedule_preview_generation()
-                total_photos += 1
+        photos = Photo.objects.filter(batch__in=queryset)
+        for counts in photos.order_by().values('batch_id').annotate(count=Count('id')):
+            start_progress(counts['batch_id'], 'previews', counts['count'])
+        
+        # One UPDATE and a paced, chunked publish for every selected batch
+        total_photos = requeue_previews(photos)
         
         self.message_user(
             request,
@@ -295,13 +531,28 @@ class BatchAdmin(ModelAdmin):
             messages.SUCCESS
         )
 
+    @action(description='Resume failed upload ingests')
+    def resume_ingest(self, request, queryset):
+        """Admin action to retry the staged files of ingests that gave up"""
+        count = 0
+        for batch in queryset.filter(ingest_status='failed'):
+            names = staged_files(batch.id)
+            if names and batch.resume_ingest(len(names)):
+                ingest_batch_upload.delay(str(batch.id), names)
+                count += 1
+        
+        self.message_user(
+            request,
+            f"✓ Resumed the upload ingest of {count} batch(es).",
+            messages.SUCCESS
+        )
+
     @display(description='Photos')
     def view_photos_link(self, obj):
         """Link to filtered photo admin showing this batch's photos"""
         if not obj.id:
             return "-"
         
-        from django.urls import reverse
         url = reverse('admin:photos_photo_changelist') + f'?batch__id__exact={obj.id}'
         count = obj.photos.count()
         
@@ -311,61 +562,76 @@ class BatchAdmin(ModelAdmin):
             count
         )
     
-    @transaction.atomic
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        finally:
+            # An invalid form is shown again and resubmitted with the files:
+            # originals already streamed with this request would be orphaned
+            if (request.method == 'POST' and settings.ADMIN_UPLOAD_MODE == 'stream'
+                    and not getattr(request, 'bulk_upload_saved', False)):
+                discard_streamed(request.FILES.getlist('bulk_upload'))
+    
     def save_model(self, request, obj, form, change):
         """
         Save the batch and handle photo uploads asynchronously.
         """
+        # Originals streamed while the request arrived were stored under
+        # the id reserved for a new batch (see photos.upload_handlers)
+        if not change and hasattr(request, 'upload_batch_id'):
+            obj.id = request.upload_batch_id
+        
         # Save the batch first
-        is_new = obj.pk is None
         super().save_model(request, obj, form, change)
         
-        # Handle bulk photo uploads
+        # Handle bulk photo uploads once the admin's transaction has
+        # committed, so it is not held open while files are handled
         files = request.FILES.getlist('bulk_upload')
         
-        if files:
-            self._process_bulk_upload(request, obj, files)
+        if files and settings.ADMIN_UPLOAD_MODE == 'staged':
+            transaction.on_commit(lambda: self._queue_ingest(request, obj, files))
+        elif files:
+            request.bulk_upload_saved = True
+            transaction.on_commit(lambda: self._process_bulk_upload(request, obj, files))
+    
+    def _queue_ingest(self, request, batch, files):
+        """Stage the files and leave uploading them to the ingest task"""
+        staged, failed = stage_files(batch.id, files)
+        
+        if staged:
+            batch.queue_ingest(len(staged))
+            ingest_batch_upload.delay(str(batch.id), staged)
+            
+            messages.success(
+                request,
+                f"✓ Received {len(staged)} photo(s) for batch '{batch.title}'. "
+                f"They are uploaded to Cloudinary in the background, then previews and the ZIP are generated."
+            )
+        
+        for file, error in failed:
+            messages.error(request, f"✗ Failed to upload '{file.name}': {error}")
+        if failed:
+            messages.warning(request, f"{len(failed)} photo(s) failed to upload")
     
     def _process_bulk_upload(self, request, batch, files):
-        """Process bulk photo uploads asynchronously"""
-        uploaded_count = 0
+        """Upload the files in parallel, record them as photos and queue their processing"""
         failed_uploads = []
-        photo_ids = []
+        upload_results = []
         
-        # First, upload all files to Cloudinary and create Photo objects
-        for file in files:
-            # Validate file size (e.g., max 25MB per file)
-            if file.size > 25 * 1024 * 1024:
-                failed_uploads.append({
-                    'filename': file.name,
-                    'error': 'File too large (max 25MB)'
-                })
-                continue
-            
-            try:
-                # Upload to Cloudinary
-                upload_result = uploader.upload(
-                    file,
-                    folder=f'batches/{batch.id}/originals',
-                    resource_type='image',
-                    use_filename=True,
-                    unique_filename=True
-                )
-                
-                # Create Photo object (preview will be generated asynchronously)
-                photo = Photo.objects.create(
-                    batch=batch,
-                    original_image=upload_result['public_id']
-                )
-                
-                photo_ids.append(str(photo.id))
-                uploaded_count += 1
-                
-            except Exception as e:
+        # Upload all files to Cloudinary, ADMIN_UPLOAD_CONCURRENCY at a time
+        # (files streamed to Cloudinary with the request are already there)
+        for file, result in upload_originals(batch.id, files, settings.ADMIN_UPLOAD_CONCURRENCY):
+            if isinstance(result, Exception):
                 failed_uploads.append({
                     'filename': file.name,
-                    'error': str(e)
+                    'error': str(result)
                 })
+            else:
+                upload_results.append(result)
+        
+        # Create the Photo objects at once (previews are generated asynchronously)
+        photo_ids = [str(photo.id) for photo in create_photos(batch.id, upload_results)]
+        uploaded_count = len(photo_ids)
         
         # Queue background processing
         if photo_ids:
@@ -383,7 +649,7 @@ class BatchAdmin(ModelAdmin):
             
             messages.info(
                 request,
-                f"Processing task ID: {result.id}. Refresh this page in a few minutes to see updates."
+                f"Processing task ID: {result.id}. Progress is shown live on the batch page."
             )
         
         # Report failures
@@ -408,7 +674,7 @@ class PhotoAdmin(ModelAdmin):
         'preview_status_display',
         'created_at'
     ]
-    list_filter = ['preview_status', 'batch', 'created_at']
+    list_filter = ['preview_status', 'preview_error_kind', 'batch', 'created_at']
     list_select_related = ['batch']
     readonly_fields = [
         'id', 
@@ -464,7 +730,7 @@ class PhotoAdmin(ModelAdmin):
     def preview_thumbnail_large(self, obj):
         """Display larger preview in detail view"""
         if obj.id:
-            url = obj.preview_url()
+            url = obj.preview_url
             if url:
                 return format_html(
                     '<img src="{}" style="max-width: 600px; height: auto; border-radius: 8px; border: 1px solid #374151; box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3);" />',
@@ -503,7 +769,8 @@ class PhotoAdmin(ModelAdmin):
         """Display preview error if any"""
         if obj.preview_error:
             return format_html(
-                '<pre style="color: #fca5a5; white-space: pre-wrap; background-color: rgba(239, 68, 68, 0.1); padding: 12px; border-radius: 6px; border-left: 4px solid #ef4444;">{}</pre>',
+                '<pre style="color: #fca5a5; white-space: pre-wrap; background-color: rgba(239, 68, 68, 0.1); padding: 12px; border-radius: 6px; border-left: 4px solid #ef4444;">{}{}</pre>',
+                f'[{obj.get_preview_error_kind_display()}] ' if obj.preview_error_kind else '',
                 obj.preview_error
             )
         return format_html('<span style="color: #22c55e; font-weight: 500;">✓ No errors</span>')
@@ -511,11 +778,7 @@ class PhotoAdmin(ModelAdmin):
     @action(description='Retry preview generation')
     def retry_preview_generation(self, request, queryset):
         """Admin action to retry preview generation for selected photos"""
-        count = 0
-        for photo in queryset:
-            if photo.preview_status in ['failed', 'pending']:
-                photo.schedule_preview_generation()
-                count += 1
+        count = requeue_previews(queryset.filter(preview_status__in=['failed', 'pending']))
         
         self.message_user(
             request,
@@ -526,14 +789,13 @@ class PhotoAdmin(ModelAdmin):
     @action(description='Delete and regenerate previews')
     def force_delete_previews(self, request, queryset):
         """Admin action to delete and regenerate previews"""
-        count = 0
-        for photo in queryset:
-            photo.preview_image = None
-            photo.preview_status = 'pending'
-            photo.preview_error = None
-            photo.save(update_fields=['preview_image', 'preview_status', 'preview_error'])
-            photo.schedule_preview_generation()
-            count += 1
+        count = requeue_previews(
+            queryset,
+            preview_image=None,
+            renditions=[],
+            preview_error=None,
+            preview_error_kind=''
+        )
         
         self.message_user(
             request,
@@ -0,0 +1,278 @@
+"""ZIP archive helpers: manifests and incremental maintenance of batch ZIPs"""
+import logging
+import shutil
+import zipfile
+
+from cloudinary import CloudinaryImage, api
+
+from .fetching import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT, fetch_originals
+from .uploads import ChunkedUploadError, ChunkedUploadWriter
+
+
+logger = logging.getLogger('photos')
+
+MANIFEST_VERSION = 1
+
+# Local header, data descriptor and central directory record of one entry,
+# including Zip64 extra fields (the entry name comes on top, twice)
+ENTRY_OVERHEAD = 30 + 24 + 46 + 28
+
+
+class ManifestMismatch(Exception):
+    """The stored archive does not match its manifest"""
+
+
+def zip_public_id_with_ext(public_id):
+    """Raw uploads keep their extension in the public_id used for delivery"""
+    public_id = str(public_id)
+    return public_id if public_id.endswith('.zip') else f"{public_id}.zip"
+
+
+def zip_upload_options(public_id):
+    """Cloudinary upload options of a batch ZIP (or ZIP volume)"""
+    return {
+        'resource_type': 'raw',
+        'public_id': public_id,
+        'format': 'zip',
+        'overwrite': True,
+    }
+
+
+def destroy_zip_archives(public_ids):
+    """Delete stored ZIPs that nothing refers to any more (failures are only logged)"""
+    try:
+        api.delete_resources([zip_public_id_with_ext(public_id) for public_id in public_ids], resource_type='raw')
+    except Exception as e:
+        logger.warning(f"Could not delete ZIP archive(s) {', '.join(public_ids)}: {e}")
+
+
+def download_archive(session, public_id, fileobj):
+    """Stream a stored ZIP from Cloudinary into `fileobj`"""
+    url = CloudinaryImage(zip_public_id_with_ext(public_id)).build_url(resource_type='raw')
+    with session.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                fileobj.write(chunk)
+    fileobj.flush()
+
+
+def build_manifest(zipf, photos_by_name, archive_size):
+    """
+    Describe every entry of a closed archive: which photo it holds, where its
+    local header starts and its CRC.
+    """
+    entries = []
+    for info in zipf.infolist():
+        photo = photos_by_name.get(info.filename)
+        entries.append({
+            'name': info.filename,
+            'photo_id': str(photo.id) if photo else None,
+            'public_id': str(photo.original_image) if photo else None,
+            'offset': info.header_offset,
+            'crc': info.CRC,
+            'compress_size': info.compress_size,
+            'file_size': info.file_size,
+        })
+
+    return {
+        'version': MANIFEST_VERSION,
+        'entries': entries,
+        'archive_size': archive_size,
+        'directory_offset': zipf.start_dir,
+    }
+
+
+def plan_zip_update(manifest, photos):
+    """
+    Decide how to bring an archive up to date with `photos`.
+    Returns (mode, added_photos, removed_entry_names) where mode is
+    'full', 'incremental' or 'noop'.
+    """
+    if not manifest or manifest.get('version') != MANIFEST_VERSION:
+        return 'full', list(photos), []
+
+    current = {
+        (str(photo.id), str(photo.original_image)): photo
+        for photo in photos
+    }
+    stored = {
+        (entry['photo_id'], entry['public_id']): entry
+        for entry in manifest['entries']
+    }
+
+    added = [photo for key, photo in current.items() if key not in stored]
+    removed = [entry for key, entry in stored.items() if key not in current]
+
+    if not added and not removed:
+        return 'noop', [], []
+
+    return 'incremental', added, [entry['name'] for entry in removed]
+
+
+def verify_manifest(zipf, manifest):
+    """Make sure the downloaded archive is the one the manifest describes"""
+    infos = {info.filename: info for info in zipf.infolist()}
+    for entry in manifest['entries']:
+        info = infos.get(entry['name'])
+        if info is None or info.header_offset != entry['offset'] or info.CRC != entry['crc']:
+            raise ManifestMismatch(f"Archive entry {entry['name']} does not match manifest")
+    if len(infos) != len(manifest['entries']):
+        raise ManifestMismatch("Archive has entries missing from the manifest")
+
+
+def copy_entries(source, target, names):
+    """
+    Copy entries `names` of the `source` archive into `target`, recompressed
+    with the target's compression. Entries left out are dropped for good.
+    """
+    for name in names:
+        info = source.getinfo(name)
+        copy = zipfile.ZipInfo(name, date_time=info.date_time)
+        copy.compress_type = target.compression
+        with source.open(info) as entry, target.open(copy, 'w') as copied:
+            shutil.copyfileobj(entry, copied, DOWNLOAD_CHUNK_SIZE)
+
+
+def write_entry(zipf, photo, original):
+    """
+    Copy a fetched original into the archive under the photo's entry name.
+    Returns the number of bytes copied.
+    """
+    with original, zipf.open(photo.zip_entry_name(), 'w') as zip_entry:
+        shutil.copyfileobj(original, zip_entry, DOWNLOAD_CHUNK_SIZE)
+    return zipf.filelist[-1].file_size
+
+
+def write_zip_entries(zipf, photos, session, concurrency, progress=None):
+    """
+    Fetch originals concurrently and append them to `zipf` in photo order.
+    Every photo handled (written or skipped) is reported to `progress`.
+    """
+    fetched = fetch_originals(photos, concurrency=concurrency, session=session)
+
+    for photo, original in fetched:
+        if isinstance(original, Exception):
+            logger.warning(f"Failed to add photo {photo.id} to ZIP: {original}")
+            if progress:
+                progress.advance()
+            continue
+
+        try:
+            written = write_entry(zipf, photo, original)
+        except ChunkedUploadError:
+            raise
+        except Exception as e:
+            logger.exception(f"Failed to add photo {photo.id} to ZIP: {e}")
+            written = 0
+
+        if progress:
+            progress.advance(nbytes=written)
+
+    if progress:
+        progress.flush()
+
+
+def build_zip_upload(photos, upload_options, session, concurrency, chunk_size, filename, progress=None):
+    """
+    Build an archive of `photos` straight into a chunked Cloudinary upload.
+    Returns (manifest, upload_result).
+    """
+    writer = ChunkedUploadWriter(upload_options, chunk_size=chunk_size, filename=filename)
+
+    try:
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            write_zip_entries(zipf, photos, session, concurrency, progress=progress)
+        upload_result = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+    photos_by_name = {photo.zip_entry_name(): photo for photo in photos}
+    return build_manifest(zipf, photos_by_name, writer.tell()), upload_result
+
+
+def estimated_entry_size(photo):
+    """Upper bound of the bytes a photo adds to an archive"""
+    return (photo.original_bytes or 0) + ENTRY_OVERHEAD + 2 * len(photo.zip_entry_name())
+
+
+def split_into_volumes(photos, max_bytes):
+    """
+    Group `photos` (keeping their order) into volumes whose archives stay
+    under `max_bytes`. A photo larger than the cap gets a volume of its own.
+    """
+    volumes = []
+    current, current_size = [], 0
+
+    for photo in photos:
+        size = estimated_entry_size(photo)
+        if current and current_size + size > max_bytes:
+            volumes.append(current)
+            current, current_size = [], 0
+        current.append(photo)
+        current_size += size
+
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+class _StreamSink:
+    """
+    Write-only, unseekable file object collecting ZIP output between yields.
+    Because it cannot seek, zipfile writes sizes and CRCs in data descriptors
+    after each entry instead of patching local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(photos, concurrency):
+    """
+    Generate a ZIP of the originals of `photos` chunk by chunk.
+    Entries are stored uncompressed, so memory use does not grow with the
+    archive and each chunk goes out as soon as it is fetched.
+    """
+    sink = _StreamSink()
+    fetched = fetch_originals(photos, concurrency=concurrency)
+
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+            for photo, original in fetched:
+                if isinstance(original, Exception):
+                    logger.warning(f"Failed to stream photo {photo.id}: {original}")
+                    continue
+
+                with original, zipf.open(photo.zip_entry_name(), 'w') as zip_entry:
+                    while True:
+                        chunk = original.read(DOWNLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        zip_entry.write(chunk)
+                        yield sink.drain()
+
+                yield sink.drain()
+
+        # Central directory
+        yield sink.drain()
+    finally:
+        fetched.close()
@@ -0,0 +1,68 @@
+"""
+Completion barriers: run a follow-up exactly once after a set of members
+(e.g. the photos of an upload) has been processed.
+
+Each member id is added to a Redis set when it reaches its final outcome.
+Adding is idempotent, so retries and duplicate deliveries are harmless. The
+caller whose arrival completes the set wins a SET NX and fires the follow-up.
+Nothing is kept per member beyond its id, unlike a chord's stored results.
+"""
+import uuid
+
+from django_redis import get_redis_connection
+
+
+BARRIER_TTL = 24 * 60 * 60
+
+
+def _keys(barrier_id):
+    prefix = f'barrier:{barrier_id}'
+    return f'{prefix}:total', f'{prefix}:arrived', f'{prefix}:failed', f'{prefix}:fired'
+
+
+def open_barrier(batch_id, member_ids):
+    """Start a barrier over `member_ids` and return its id"""
+    barrier_id = f'{batch_id}:{uuid.uuid4().hex}'
+    total_key, _, _, _ = _keys(barrier_id)
+    get_redis_connection('default').set(total_key, len(set(member_ids)), ex=BARRIER_TTL)
+    return barrier_id
+
+
+def barrier_batch_id(barrier_id):
+    return barrier_id.split(':', 1)[0]
+
+
+def arrive(barrier_id, member_ids, failed=False):
+    """
+    Record that `member_ids` reached their final outcome (`failed` ones are
+    counted separately). Returns True for exactly one caller: the one whose
+    arrival completes the barrier. Returns None if the barrier is unknown
+    (expired), so the caller can fall back to another trigger.
+    """
+    member_ids = [str(member_id) for member_id in member_ids]
+    total_key, arrived_key, failed_key, fired_key = _keys(barrier_id)
+    redis = get_redis_connection('default')
+
+    with redis.pipeline() as pipe:
+        if member_ids:
+            pipe.sadd(arrived_key, *member_ids)
+            if failed:
+                pipe.sadd(failed_key, *member_ids)
+        pipe.expire(arrived_key, BARRIER_TTL)
+        pipe.expire(failed_key, BARRIER_TTL)
+        pipe.scard(arrived_key)
+        pipe.get(total_key)
+        *_, arrived, total = pipe.execute()
+
+    if total is None:
+        return None
+    if arrived < int(total):
+        return False
+
+    return bool(redis.set(fired_key, 1, nx=True, ex=BARRIER_TTL))
+
+
+def barrier_failures(barrier_id):
+    """Number of members that arrived as failed"""
+    _, _, failed_key, _ = _keys(barrier_id)
+    return get_redis_connection('default').scard(failed_key)
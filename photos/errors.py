@@ -0,0 +1,160 @@
+"""
+Failure classification for the background pipelines.
+
+- transient: network errors, timeouts and 5xx responses; retried with
+  exponential backoff and full jitter so retries after an incident spread out
+- rate_limited: 420/429 responses; retried no sooner than Retry-After
+- permanent: missing or invalid resources (4xx, undecodable images);
+  never retried, recorded in the dead-letter list instead
+"""
+import json
+import logging
+import random
+from email.utils import parsedate_to_datetime
+
+import requests
+from cloudinary import exceptions as cloudinary_exceptions
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from django_redis import get_redis_connection
+from PIL import Image, UnidentifiedImageError
+
+from helpers.metrics import incr_metric
+
+
+logger = logging.getLogger('photos')
+
+TRANSIENT = 'transient'
+RATE_LIMITED = 'rate_limited'
+PERMANENT = 'permanent'
+
+ERROR_KIND_CHOICES = [
+    (TRANSIENT, 'Transient'),
+    (RATE_LIMITED, 'Rate limited'),
+    (PERMANENT, 'Permanent'),
+]
+
+DEAD_LETTER_KEY = 'dead_letters'
+
+RATE_LIMIT_STATUSES = {420, 429}
+TRANSIENT_STATUSES = {408, 425}
+
+PERMANENT_EXCEPTIONS = (
+    cloudinary_exceptions.NotFound,
+    cloudinary_exceptions.BadRequest,
+    cloudinary_exceptions.NotAllowed,
+    cloudinary_exceptions.AuthorizationRequired,
+    cloudinary_exceptions.AlreadyExists,
+    UnidentifiedImageError,
+    Image.DecompressionBombError,
+    ObjectDoesNotExist,
+)
+
+
+class PermanentError(Exception):
+    """A failure that retrying cannot fix (e.g. a photo without an original)"""
+
+
+def retry_after_seconds(response):
+    """Seconds requested by a Retry-After header (delta or HTTP date), or None"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, int((parsedate_to_datetime(value) - timezone.now()).total_seconds()))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(exc):
+    """Returns (kind, retry_after seconds or None) for a pipeline exception"""
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        if status in RATE_LIMIT_STATUSES:
+            return RATE_LIMITED, retry_after_seconds(exc.response)
+        if status >= 500 or status in TRANSIENT_STATUSES:
+            return TRANSIENT, retry_after_seconds(exc.response)
+        return PERMANENT, None
+    if isinstance(exc, cloudinary_exceptions.RateLimited):
+        return RATE_LIMITED, None
+    if isinstance(exc, (PermanentError,) + PERMANENT_EXCEPTIONS):
+        return PERMANENT, None
+    if exc.__cause__ is not None:
+        # Wrappers such as ChunkedUploadError fail the way their cause did
+        return classify(exc.__cause__)
+    # Connection errors, timeouts, Cloudinary 5xx and anything unknown
+    return TRANSIENT, None
+
+
+def backoff_delay(retries, base, retry_after=None):
+    """
+    Seconds to wait before retry number `retries` + 1: a random delay up to
+    base * 2^retries (capped at TASK_RETRY_BACKOFF_MAX), but never less than
+    the server's Retry-After.
+    """
+    ceiling = min(settings.TASK_RETRY_BACKOFF_MAX, base * 2 ** retries)
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        # Spread the callers the server told to come back at the same moment
+        delay = retry_after + random.uniform(0, min(base, ceiling))
+    return round(delay)
+
+
+def retry_or_dead_letter(task, exc, **retry_kwargs):
+    """
+    Retry the running Celery `task` after a backoff suited to `exc`, or
+    dead-letter it when the failure is permanent or retries are exhausted.
+    Always raises: celery's Retry, or `exc` itself.
+    """
+    kind, retry_after = classify(exc)
+    if kind != PERMANENT and task.request.retries < task.max_retries:
+        countdown = backoff_delay(task.request.retries, task.default_retry_delay, retry_after)
+        raise task.retry(exc=exc, countdown=countdown, **retry_kwargs)
+
+    dead_letter(task.name, retry_kwargs.get('args', task.request.args), exc, kind)
+    raise exc
+
+
+def dead_letter(task_name, args, exc, kind=None):
+    """Record a task that will not be retried in the capped dead-letter list"""
+    kind = kind or classify(exc)[0]
+    entry = {
+        'task': task_name,
+        'args': list(args or []),
+        'kind': kind,
+        'error': f'{type(exc).__name__}: {exc}',
+        'failed_at': timezone.now().isoformat(),
+    }
+    logger.warning(f'Dead-lettered {task_name}{tuple(entry["args"])} ({kind}): {entry["error"]}')
+    incr_metric('dead_lettered')
+
+    try:
+        redis = get_redis_connection('default')
+        with redis.pipeline() as pipe:
+            pipe.lpush(DEAD_LETTER_KEY, json.dumps(entry, default=str))
+            pipe.ltrim(DEAD_LETTER_KEY, 0, settings.DEAD_LETTER_MAX - 1)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f'Could not store dead letter for {task_name}: {e}')
+    return entry
+
+
+def get_dead_letters(limit=100):
+    """Most recent dead letters first"""
+    redis = get_redis_connection('default')
+    return [json.loads(entry) for entry in redis.lrange(DEAD_LETTER_KEY, 0, limit - 1)]
+
+
+def clear_dead_letters():
+    """Remove every dead letter; returns how many there were"""
+    redis = get_redis_connection('default')
+    with redis.pipeline() as pipe:
+        pipe.llen(DEAD_LETTER_KEY)
+        pipe.delete(DEAD_LETTER_KEY)
+        count, _ = pipe.execute()
+    return count
@@ -0,0 +1,169 @@
+"""Concurrent fetching of original images for background pipelines"""
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from cloudinary import CloudinaryImage
+
+from .originals_cache import cache_key, get_originals_cache
+
+
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Fetched originals stay in memory up to this size, then spill to disk
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+
+def original_download_url(public_id, version=None):
+    """Build the delivery URL of an original upload (of a given version, if known)"""
+    return CloudinaryImage(str(public_id)).build_url(
+        resource_type='image',
+        type='upload',
+        version=version
+    )
+
+
+def build_session(pool_size=10):
+    """HTTP session whose connection pool fits `pool_size` concurrent requests"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def download_to(session, url, fileobj, timeout=DOWNLOAD_TIMEOUT):
+    """Stream `url` into `fileobj`"""
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                fileobj.write(chunk)
+
+
+def download_to_spool(session, url, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Stream `url` into a spooled temporary file and return it rewound.
+    The caller owns (and must close) the returned file.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        download_to(session, url, spool, timeout=timeout)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool
+
+
+def download_cached(session, url, resource, version=None, variant=None):
+    """
+    Open the content of `url` through the host's originals cache.
+    `resource` (a CloudinaryField value), its upload `version` and `variant`
+    identify the content.
+    Falls back to a plain download when the cache is disabled.
+    The caller owns (and must close) the returned file.
+    """
+    originals_cache = get_originals_cache()
+    if originals_cache is None:
+        return download_to_spool(session, url)
+
+    key = cache_key(str(resource), version or getattr(resource, 'version', None), variant)
+    return originals_cache.get_or_download(key, lambda fileobj: download_to(session, url, fileobj))
+
+
+def _discard(future):
+    """Close the file produced by a fetch nobody is going to consume"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if hasattr(result, 'close'):
+        result.close()
+
+
+def fetch_in_order(items, fetch, concurrency):
+    """
+    Run `fetch(item)` on a bounded thread pool and yield `(item, result)`
+    in input order, so a single consumer can write results sequentially.
+
+    At most `concurrency` fetches are running or waiting to be consumed at
+    any time. A failed fetch yields the raised exception as its result
+    instead of stopping the whole run.
+    """
+    concurrency = max(1, int(concurrency))
+    items = iter(items)
+    window = deque()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='fetch') as executor:
+        def submit_next():
+            for item in items:
+                window.append((item, executor.submit(fetch, item)))
+                return
+
+        for _ in range(concurrency):
+            submit_next()
+
+        try:
+            while window:
+                item, future = window.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+
+                # Keep the pool busy while the consumer handles this result
+                submit_next()
+                yield item, result
+        finally:
+            # Consumer stopped early: drop queued work and release buffers
+            while window:
+                _, future = window.popleft()
+                future.cancel()
+                future.add_done_callback(_discard)
+
+
+def fetch_originals(photos, concurrency, session=None):
+    """
+    Download the originals of `photos` concurrently, through the host's
+    originals cache.
+    Yields `(photo, spooled_file_or_exception)` in the order of `photos`.
+    """
+    owns_session = session is None
+    if owns_session:
+        session = build_session(pool_size=concurrency)
+
+    def fetch(photo):
+        url = original_download_url(photo.original_image, photo.original_version)
+        return download_cached(session, url, photo.original_image, version=photo.original_version)
+
+    try:
+        yield from fetch_in_order(photos, fetch, concurrency)
+    finally:
+        if owns_session:
+            session.close()
+
+
+def fetch_original_sizes(photos, concurrency, session=None):
+    """
+    Look up the size of each original with concurrent HEAD requests.
+    Yields `(photo, size_or_exception)` in the order of `photos`.
+    """
+    owns_session = session is None
+    if owns_session:
+        session = build_session(pool_size=concurrency)
+
+    def fetch(photo):
+        url = original_download_url(photo.original_image, photo.original_version)
+        response = session.head(url, timeout=DOWNLOAD_TIMEOUT, allow_redirects=True)
+        response.raise_for_status()
+        return int(response.headers['Content-Length'])
+
+    try:
+        yield from fetch_in_order(photos, fetch, concurrency)
+    finally:
+        if owns_session:
+            session.close()
@@ -0,0 +1,244 @@
+"""
+Ingesting originals: uploading them to Cloudinary and recording them as photos.
+
+Files are uploaded through a bounded thread pool; the Photo rows are then
+created in one bulk_create once every upload has finished, so no database
+transaction stays open while bytes travel to Cloudinary.
+
+The batch admin can also skip Django entirely: it hands the browser signed
+upload parameters (signed_upload_params), the browser uploads straight to
+Cloudinary and reports the results back, which are checked against
+Cloudinary's response signatures (verified_uploads) before being recorded.
+
+With ADMIN_UPLOAD_MODE = 'staged' the admin request does not talk to
+Cloudinary at all: files are written to the staging storage
+(STORAGES['staging'], which web and workers must share) and the
+ingest_batch_upload task uploads them. A staged file is deleted once it is
+recorded as a photo, so whatever is still staged has not been ingested yet.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudinary import api, uploader, utils
+from django.conf import settings
+from django.core.files.storage import storages
+from django.utils import timezone
+
+from .models import Batch, Photo
+from .previews import preview_upload_options
+from .uploads import StreamedUpload
+
+
+logger = logging.getLogger('photos')
+
+MAX_ORIGINAL_BYTES = 25 * 1024 * 1024
+
+# Public ids per Admin API delete_resources call
+DELETE_BATCH_SIZE = 100
+
+
+class UploadRejected(Exception):
+    """A file refused before upload (e.g. too large)"""
+
+
+def original_upload_options(batch_id):
+    """Cloudinary upload options for the originals of a batch"""
+    return {
+        'folder': f'batches/{batch_id}/originals',
+        'resource_type': 'image',
+        'use_filename': True,
+        'unique_filename': True,
+        **preview_upload_options(),
+    }
+
+
+def signed_upload_params(batch_id):
+    """
+    Signed parameters that let a browser upload one original of the batch
+    directly to Cloudinary. Cloudinary rejects them after an hour.
+    Returns (upload url, form fields).
+    """
+    options = original_upload_options(batch_id)
+    fields = utils.sign_request(utils.build_upload_params(**options), {})
+    return utils.cloudinary_api_url('upload', resource_type=options['resource_type']), fields
+
+
+def verified_uploads(batch_id, uploads):
+    """
+    Keep the browser-reported upload results that Cloudinary really signed
+    and that belong to the batch's originals folder, dropping duplicates and
+    public_ids already recorded as photos.
+    Returns (accepted results, number rejected).
+    """
+    prefix = original_upload_options(batch_id)['folder'] + '/'
+    accepted = {}
+    rejected = 0
+
+    for upload in uploads:
+        try:
+            public_id = str(upload['public_id'])
+            valid = public_id.startswith(prefix) and utils.verify_api_response_signature(
+                public_id, upload['version'], upload['signature']
+            )
+        except (KeyError, TypeError):
+            valid = False
+        if not valid:
+            rejected += 1
+            continue
+        size = upload.get('bytes')
+        accepted[public_id] = {
+            'public_id': public_id,
+            'bytes': size if isinstance(size, int) else None,
+            'version': upload['version'] if isinstance(upload['version'], int) else None,
+        }
+
+    existing = {
+        str(original) for original in
+        Photo.objects.filter(batch_id=batch_id, original_image__in=list(accepted))
+        .values_list('original_image', flat=True)
+    }
+    return [result for public_id, result in accepted.items() if public_id not in existing], rejected
+
+
+def upload_original(batch_id, file):
+    """
+    Upload one original; returns the Cloudinary upload result. Files the
+    request already streamed to Cloudinary just hand back their result.
+    """
+    if isinstance(file, StreamedUpload):
+        if file.error is not None:
+            raise file.error
+        return file.result
+    if file.size > MAX_ORIGINAL_BYTES:
+        raise UploadRejected(f'File too large (max {MAX_ORIGINAL_BYTES // 1024 // 1024}MB)')
+    return uploader.upload(file, **original_upload_options(batch_id))
+
+
+def _upload_all(upload, items, concurrency):
+    def run(item):
+        try:
+            return item, upload(item)
+        except Exception as e:
+            return item, e
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='upload') as executor:
+        return list(executor.map(run, items))
+
+
+def upload_originals(batch_id, files, concurrency):
+    """
+    Upload `files` at most `concurrency` at a time.
+    Returns a list of (file, upload result or Exception), in input order.
+    """
+    return _upload_all(lambda file: upload_original(batch_id, file), files, concurrency)
+
+
+def discard_streamed(files):
+    """
+    Delete the originals a request streamed to Cloudinary (StreamedUpload)
+    when they are not going to be recorded, e.g. because the form was
+    invalid. Returns the number of originals deleted.
+    """
+    public_ids = [
+        file.result['public_id'] for file in files
+        if isinstance(file, StreamedUpload) and file.result
+    ]
+    for start in range(0, len(public_ids), DELETE_BATCH_SIZE):
+        chunk = public_ids[start:start + DELETE_BATCH_SIZE]
+        try:
+            api.delete_resources(chunk)
+        except Exception:
+            # Left for clean_orphaned_cloudinary
+            logger.exception('Could not delete %d streamed original(s)', len(chunk))
+    return len(public_ids)
+
+
+def staging_storage():
+    """The staging storage, or None if none is configured"""
+    if 'staging' not in settings.STORAGES:
+        return None
+    return storages['staging']
+
+
+def stage_files(batch_id, files):
+    """
+    Save uploaded `files` to the staging storage under the batch's folder.
+    Large uploads already spooled to a temporary file are moved, not copied.
+    Returns (staged names, [(file, Exception)] for files that were refused).
+    """
+    storage = staging_storage()
+    names = []
+    failures = []
+    for file in files:
+        try:
+            if file.size > MAX_ORIGINAL_BYTES:
+                raise UploadRejected(f'File too large (max {MAX_ORIGINAL_BYTES // 1024 // 1024}MB)')
+            names.append(storage.save(f'{batch_id}/{file.name}', file))
+        except Exception as e:
+            failures.append((file, e))
+    return names, failures
+
+
+def staged_files(batch_id, older_than=None):
+    """
+    Names of the batch's staged files, optionally only those last written
+    before `older_than` (files still being written are left alone).
+    """
+    storage = staging_storage()
+    if storage is None:
+        return []
+    try:
+        _, files = storage.listdir(str(batch_id))
+    except FileNotFoundError:
+        return []
+    names = [f'{batch_id}/{name}' for name in files]
+    if older_than is not None:
+        names = [name for name in names if storage.get_modified_time(name) < older_than]
+    return names
+
+
+def discard_staged(names):
+    storage = staging_storage()
+    for name in names:
+        storage.delete(name)
+
+
+def upload_staged(batch_id, names, concurrency):
+    """
+    Upload staged files at most `concurrency` at a time.
+    Returns a list of (name, upload result or Exception), in input order.
+    """
+    storage = staging_storage()
+
+    def upload(name):
+        with storage.open(name) as file:
+            # Cloudinary names the original after the file (use_filename)
+            file.name = os.path.basename(name)
+            return upload_original(batch_id, file)
+
+    return _upload_all(upload, names, concurrency)
+
+
+def create_photos(batch_id, upload_results):
+    """
+    Record uploaded originals as photos with one bulk_create. bulk_create
+    sends no post_save signals, so the batch ZIP is marked out of date here
+    (see photos.signals.photo_saved).
+    Returns the created photos.
+    """
+    photos = Photo.objects.bulk_create([
+        Photo(
+            batch_id=batch_id,
+            original_image=result['public_id'],
+            original_bytes=result.get('bytes'),
+            original_version=result.get('version')
+        )
+        for result in upload_results
+    ])
+
+    if photos:
+        Batch.objects.filter(id=batch_id, zip_status='completed').update(
+            zip_status='pending', zip_status_changed_at=timezone.now()
+        )
+    return photos
@@ -0,0 +1,121 @@
+"""
+Redis leases that keep a single worker on a job at a time, and database
+heartbeats that show a job marked 'processing' still has a live worker.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+
+logger = logging.getLogger('photos')
+
+
+class Lease:
+    """
+    Non-blocking Redis lock with a time-to-live that a heartbeat thread keeps
+    renewing while the holder is alive. If the holder dies, the lease simply
+    expires after `ttl` seconds and another worker can take over.
+    """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self._lock = get_redis_connection('default').lock(
+            name,
+            timeout=ttl,
+            blocking=False,
+            thread_local=False  # the heartbeat thread renews with our token
+        )
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """Take the lease; returns False when someone else holds it"""
+        if not self._lock.acquire():
+            return False
+
+        self._heartbeat = threading.Thread(
+            target=self._renew,
+            name=f'lease-{self.name}',
+            daemon=True
+        )
+        self._heartbeat.start()
+        return True
+
+    def held(self):
+        """Whether anyone currently holds the lease"""
+        return self._lock.locked()
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        try:
+            self._lock.release()
+        except LockError:
+            # Already expired or taken over
+            pass
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self._lock.reacquire()
+            except LockError:
+                logger.warning(f'Lease {self.name} was lost before the job finished')
+                return
+            except Exception as e:
+                logger.warning(f'Could not renew lease {self.name}: {e}')
+
+
+def zip_build_lease(batch_id, volume_id=None):
+    """
+    Lease guarding the ZIP build of a batch (or of one of its volumes).
+    Volumes are keyed by id: a rebuilt volume set never shares their locks.
+    """
+    name = f'lease:zip_build:{batch_id}'
+    if volume_id is not None:
+        name = f'{name}:{volume_id}'
+    return Lease(name, ttl=settings.ZIP_BUILD_LEASE_TTL)
+
+
+class Heartbeat:
+    """
+    Keeps `field` of the rows in `queryset` at the current time while a job
+    runs (use as a context manager). Rows whose heartbeat stops for
+    PROCESSING_LEASE_TIMEOUT are reclaimed by photos.reaper.
+    """
+
+    def __init__(self, queryset, field, interval=None):
+        self.queryset = queryset
+        self.field = field
+        self.interval = interval or settings.PROCESSING_HEARTBEAT_INTERVAL
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f'heartbeat-{self.field}', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def beat(self):
+        self.queryset.update(**{self.field: timezone.now()})
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.beat()
+                except Exception as e:
+                    logger.warning(f'Could not update {self.field}: {e}')
+        finally:
+            # This thread opened its own database connection
+            connection.close()
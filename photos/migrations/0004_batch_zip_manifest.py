@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0003_batch_zip_error_batch_zip_status_photo_preview_error_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='zip_manifest',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-17 03:51
+
+import cloudinary.models
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0004_batch_zip_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='original_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ZipVolume',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('index', models.PositiveIntegerField()),
+                ('photo_ids', models.JSONField(default=list)),
+                ('estimated_bytes', models.PositiveBigIntegerField(default=0)),
+                ('zip_file', cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='zip')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='zip_volumes', to='photos.batch')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('batch', 'index'), name='unique_batch_zip_volume')],
+            },
+        ),
+    ]
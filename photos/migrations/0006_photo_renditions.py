@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0005_zip_volumes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='renditions',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0006_photo_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='previews_completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='processing_pipeline',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ready_to_sell_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0007_batch_processing_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='zip_error_kind',
+            field=models.CharField(blank=True, choices=[('transient', 'Transient'), ('rate_limited', 'Rate limited'), ('permanent', 'Permanent')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='preview_error_kind',
+            field=models.CharField(blank=True, choices=[('transient', 'Transient'), ('rate_limited', 'Rate limited'), ('permanent', 'Permanent')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0008_error_kinds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='zip_heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='zip_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='preview_heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='preview_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0009_processing_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='zip_status_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='preview_status_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0010_status_changed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='ingest_uploaded',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
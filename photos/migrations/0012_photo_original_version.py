@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0011_batch_ingest_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='original_version',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
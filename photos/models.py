@@ -1,18 +1,45 @@
+import logging
 import os
 import uuid
 import requests
 import zipfile
 from io import BytesIO
 from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
 
+from django.conf import settings
 from django.db import models, transaction
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 from cloudinary import uploader, CloudinaryImage
 from PIL import Image, ImageDraw, ImageFont
 
+from .archive import (
+    ManifestMismatch, build_manifest, build_zip_upload, copy_entries, destroy_zip_archives,
+    download_archive, estimated_entry_size, plan_zip_update, split_into_volumes, verify_manifest,
+    write_zip_entries, zip_upload_options,
+)
+from .errors import ERROR_KIND_CHOICES, PermanentError, classify
+from .fetching import build_session, download_cached, fetch_original_sizes, original_download_url
+from .locks import Heartbeat
+from .previews import (
+    WATERMARK_TEXT, WATERMARK_TRANSFORMATION, derived_preview_url, uses_derived_previews,
+    uses_local_previews,
+)
+from .watermark import render_file, render_renditions
+from .progress import ProgressTracker, start_progress
+from .scheduling import mark_zip_dirty, rebuild_if_dirty, request_zip_rebuild
+from .state import (
+    COMPLETE_PREVIEW, COMPLETE_ZIP, FAIL_PREVIEW, FAIL_ZIP, RESET_ZIP, START_PREVIEW, START_ZIP,
+    apply_transition, apply_transition_many,
+)
+
+
+logger = logging.getLogger('photos')
+
 
 class BatchQuerySet(models.QuerySet):
     def with_photo_counts(self):
@@ -47,6 +74,29 @@ class Batch(models.Model):
         default='pending'
     )
     zip_error = models.TextField(blank=True, null=True)
+    zip_error_kind = models.CharField(max_length=20, choices=ERROR_KIND_CHOICES, blank=True)
+    zip_manifest = models.JSONField(blank=True, null=True)
+    # Set while zip_status is 'processing'; see photos.reaper
+    zip_started_at = models.DateTimeField(blank=True, null=True)
+    zip_heartbeat_at = models.DateTimeField(blank=True, null=True)
+    zip_status_changed_at = models.DateTimeField(blank=True, null=True)
+    
+    # Timeline of the latest upload, to measure time until the batch can be sold
+    processing_pipeline = models.CharField(max_length=20, blank=True)
+    processing_started_at = models.DateTimeField(blank=True, null=True)
+    previews_completed_at = models.DateTimeField(blank=True, null=True)
+    ready_to_sell_at = models.DateTimeField(blank=True, null=True)
+    
+    # Background ingestion of staged admin uploads (photos.ingest); the
+    # heartbeat is kept fresh while an ingest task runs, see photos.reaper
+    ingest_status = models.CharField(max_length=20, choices=ZIP_STATUS_CHOICES, blank=True)
+    ingest_total = models.PositiveIntegerField(default=0)
+    ingest_uploaded = models.PositiveIntegerField(default=0)
+    ingest_failed = models.PositiveIntegerField(default=0)
+    ingest_error = models.TextField(blank=True, null=True)
+    ingest_queued_at = models.DateTimeField(blank=True, null=True)
+    ingest_heartbeat_at = models.DateTimeField(blank=True, null=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -70,11 +120,151 @@ class Batch(models.Model):
     @cached_property
     def preview_image_url(self):
         """Get preview image URL from first photo"""
-        first_photo = self.photos.only('preview_image', 'original_image').first()
+        first_photo = self.photos.only('preview_image', 'renditions').first()
         if first_photo:
             return first_photo.preview_url
         return None
     
+    @property
+    def time_to_sell(self):
+        """Time from the start of the latest upload processing until ready to sell"""
+        if self.processing_started_at and self.ready_to_sell_at:
+            return self.ready_to_sell_at - self.processing_started_at
+        return None
+    
+    def start_processing(self, pipeline):
+        """
+        Reset the timeline (and ZIP status) for a new upload run. A ZIP build
+        that is running keeps its status and rebuilds once more when it
+        finishes.
+        """
+        Batch.objects.filter(id=self.id).update(
+            processing_pipeline=pipeline,
+            processing_started_at=timezone.now(),
+            previews_completed_at=None,
+            ready_to_sell_at=None,
+        )
+        build_running = Batch.objects.filter(id=self.id, zip_status='processing').exists
+        if not apply_transition(self, RESET_ZIP, zip_error=None, zip_error_kind='') and build_running():
+            mark_zip_dirty(self.id, build_running=build_running)
+    
+    def zip_heartbeat(self):
+        """Heartbeat to hold while building this batch's ZIP"""
+        return Heartbeat(Batch.objects.filter(id=self.id, zip_status='processing'), 'zip_heartbeat_at')
+    
+    def queue_ingest(self, count):
+        """
+        Count `count` newly staged files towards the batch's ingest. Joins an
+        ingest that is still running, otherwise starts a fresh count.
+        """
+        joined = Batch.objects.filter(id=self.id, ingest_status__in=['pending', 'processing']).update(
+            ingest_total=models.F('ingest_total') + count
+        )
+        if not joined:
+            Batch.objects.filter(id=self.id).update(
+                ingest_status='pending',
+                ingest_total=count,
+                ingest_uploaded=0,
+                ingest_failed=0,
+                ingest_error=None,
+                ingest_queued_at=timezone.now(),
+                ingest_heartbeat_at=None,
+            )
+    
+    def begin_ingest(self):
+        """Mark the ingest as running; returns False if there is nothing to ingest"""
+        return bool(Batch.objects.filter(
+            id=self.id, ingest_status__in=['pending', 'processing', 'failed']
+        ).update(ingest_status='processing', ingest_heartbeat_at=timezone.now()))
+    
+    def ingest_heartbeat(self):
+        """Heartbeat to hold while ingesting this batch's staged files"""
+        return Heartbeat(Batch.objects.filter(id=self.id, ingest_status='processing'), 'ingest_heartbeat_at')
+    
+    def record_ingest(self, uploaded=0, failed=0, error=None):
+        """
+        Add to the ingest counters. The ingest is completed once every
+        counted file has been uploaded or given up on.
+        """
+        values = {
+            'ingest_uploaded': models.F('ingest_uploaded') + uploaded,
+            'ingest_failed': models.F('ingest_failed') + failed,
+        }
+        if error:
+            values['ingest_error'] = error
+        Batch.objects.filter(id=self.id).update(**values)
+        
+        return bool(Batch.objects.filter(
+            id=self.id,
+            ingest_status='processing',
+            ingest_uploaded__gte=models.F('ingest_total') - models.F('ingest_failed')
+        ).update(ingest_status='completed', ingest_heartbeat_at=None))
+    
+    def abandon_ingest(self, error):
+        """
+        Complete an ingest with no files left staged, giving up on counted
+        files that never reached the workers (e.g. staged on storage they do
+        not share). Returns True if there were any.
+        """
+        return bool(Batch.objects.filter(
+            id=self.id,
+            ingest_status='processing',
+            ingest_uploaded__lt=models.F('ingest_total') - models.F('ingest_failed')
+        ).update(
+            ingest_status='completed',
+            ingest_failed=models.F('ingest_total') - models.F('ingest_uploaded'),
+            ingest_error=error,
+            ingest_heartbeat_at=None,
+        ))
+    
+    def fail_ingest(self, failed, error):
+        """Give up on `failed` files; they stay staged for resume_ingest"""
+        Batch.objects.filter(id=self.id).update(
+            ingest_status='failed',
+            ingest_failed=models.F('ingest_failed') + failed,
+            ingest_error=error,
+            ingest_heartbeat_at=None,
+        )
+    
+    def resume_ingest(self, count):
+        """Count `count` files given up on earlier as pending again"""
+        return bool(Batch.objects.filter(id=self.id, ingest_status='failed', ingest_failed__gte=count).update(
+            ingest_status='pending',
+            ingest_failed=models.F('ingest_failed') - count,
+            ingest_error=None,
+        ))
+    
+    def mark_previews_completed(self):
+        """Record the end of the preview stage; returns False if already recorded"""
+        marked = bool(Batch.objects.filter(id=self.id, previews_completed_at__isnull=True).update(
+            previews_completed_at=timezone.now()
+        ))
+        self.mark_ready_to_sell()
+        return marked
+    
+    def mark_previews_completed_if_done(self):
+        """
+        Record the end of the preview stage once no photo is left pending or
+        processing. For previews requeued outside the upload's completion
+        barrier, e.g. by the reaper. Returns True if this call recorded it.
+        """
+        if self.photos.filter(preview_status__in=['pending', 'processing']).exists():
+            return False
+        return self.mark_previews_completed()
+    
+    def mark_ready_to_sell(self):
+        """
+        Record when both previews and ZIP are done. Called as each of them
+        finishes; whichever comes second sets the timestamp, once.
+        """
+        return bool(Batch.objects.filter(
+            id=self.id,
+            processing_started_at__isnull=False,
+            previews_completed_at__isnull=False,
+            ready_to_sell_at__isnull=True,
+            zip_status='completed'
+        ).update(ready_to_sell_at=timezone.now()))
+    
     # def get_preview_image_url(self):
     #     """Get cached preview image URL"""
     #     cache_key = f'batch_preview_{self.id}'
@@ -89,103 +279,344 @@ class Batch(models.Model):
     #     return url
     
     def schedule_zip_generation(self):
-        """Queue ZIP generation as async task"""
-        # Import here to avoid circular imports
-        from .tasks import generate_batch_zip
-        
+        """
+        Queue ZIP generation as async task. Requests are debounced per batch,
+        so repeated calls within ZIP_REBUILD_QUIET_PERIOD run a single build.
+        """
         if not self.photos.exists():
             return
         
         self.zip_status = 'pending'
+        self.zip_status_changed_at = timezone.now()
         self.zip_error = None
-        self.save(update_fields=['zip_status', 'zip_error'])
+        self.zip_error_kind = ''
+        self.save(update_fields=['zip_status', 'zip_status_changed_at', 'zip_error', 'zip_error_kind'])
         
-        # Queue Celery task
-        generate_batch_zip.delay(str(self.id))
+        request_zip_rebuild(self.id)
 
+    def plan_zip_volumes(self):
+        """
+        Split the batch into size-capped ZIP volumes (ZIP_VOLUME_MAX_BYTES).
+        Sizes missing on older photos are looked up first and saved.
+        Returns a list of photo lists; a single entry means one archive.
+        """
+        photos = self.photos.only('id', 'original_image', 'original_version', 'original_bytes', 'batch_id')
+        photos = [photo for photo in photos if photo.original_image]
+        
+        unsized = [photo for photo in photos if photo.original_bytes is None]
+        if unsized:
+            sized = []
+            for photo, size in fetch_original_sizes(unsized, concurrency=settings.ZIP_FETCH_CONCURRENCY):
+                if not isinstance(size, Exception):
+                    photo.original_bytes = size
+                    sized.append(photo)
+            Photo.objects.bulk_update(sized, ['original_bytes'])
+        
+        return split_into_volumes(photos, settings.ZIP_VOLUME_MAX_BYTES)
+    
+    def start_zip_volume_build(self, volumes):
+        """
+        Record the volume manifest and build every volume in its own task.
+        Returns False without doing anything if another worker is already
+        building this batch.
+        """
+        from celery import group
+        from .tasks import generate_zip_volume
+        
+        with transaction.atomic():
+            if not apply_transition(self, START_ZIP, zip_error=None, zip_error_kind=''):
+                return False
+            
+            self.delete_zip_volumes()
+            volume_rows = ZipVolume.objects.bulk_create([
+                ZipVolume(
+                    batch=self,
+                    index=index,
+                    photo_ids=[str(photo.id) for photo in photos],
+                    estimated_bytes=sum(estimated_entry_size(photo) for photo in photos),
+                )
+                for index, photos in enumerate(volumes)
+            ])
+        
+        # Every volume task adds to the same batch-wide counters
+        start_progress(self.id, 'zip', sum(len(photos) for photos in volumes))
+        
+        group(
+            generate_zip_volume.si(str(self.id), volume.index, str(volume.id))
+            for volume in volume_rows
+        ).apply_async()
+        return True
+    
+    def finish_zip_volumes(self):
+        """Mark the batch ZIP completed once every volume has been built"""
+        if self.zip_volumes.exclude(status='completed').exists():
+            return False
+        
+        # Conditional update: only one of the last volumes to finish wins
+        finished = bool(Batch.objects.filter(
+            id=self.id,
+            zip_status__in=['processing', 'failed']
+        ).update(
+            zip_status='completed', zip_status_changed_at=timezone.now(),
+            zip_error=None, zip_error_kind='', zip_file=None, zip_manifest=None
+        ))
+        if finished:
+            self.mark_ready_to_sell()
+            rebuild_if_dirty(self.id)
+        return finished
+    
+    def delete_zip_volumes(self):
+        """Delete the volume set and, once that is committed, its archives"""
+        public_ids = [str(public_id) for public_id in self.zip_volumes.values_list('zip_file', flat=True) if public_id]
+        self.zip_volumes.all().delete()
+        if public_ids:
+            transaction.on_commit(lambda: destroy_zip_archives(public_ids))
+    
+    def completed_zip_volumes(self):
+        """Volumes of a split ZIP, or an empty list unless all of them are built"""
+        volumes = list(self.zip_volumes.all())
+        if volumes and all(volume.status == 'completed' for volume in volumes):
+            return volumes
+        return []
+    
     def generate_zip_file_sync(self):
         """
         Synchronous ZIP generation with streaming - should only be called from background task.
-        Returns tuple: (success: bool, error_message: str or None)
+        Updates the stored archive in place when its manifest allows it,
+        otherwise rebuilds it from scratch.
+        Returns tuple: (success: bool, error: Exception or None); success is
+        None when another worker is already building this batch, or took
+        the build over before it completed.
         """
         if not self.photos.exists():
-            return False, "No photos in batch"
+            return False, PermanentError("No photos in batch")
         
-        self.zip_status = 'processing'
-        self.save(update_fields=['zip_status'])
+        if not apply_transition(self, START_ZIP):
+            return None, None
         
-        import tempfile
-        import shutil
+        photos = self.photos.only('id', 'original_image', 'original_version', 'batch_id')
+        photos = [photo for photo in photos if photo.original_image]
+        
+        mode, added, removed = plan_zip_update(self.zip_manifest if self.zip_file else None, photos)
+        
+        if mode == 'noop':
+            if not apply_transition(self, COMPLETE_ZIP, zip_error=None, zip_error_kind=''):
+                return None, None
+            self.mark_ready_to_sell()
+            return True, None
         
-        # Use temporary file instead of in-memory buffer
-        temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
+        session = build_session(pool_size=settings.ZIP_FETCH_CONCURRENCY)
         
         try:
-            with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                photos = self.photos.select_related('batch').only(
-                    'id', 'original_image', 'batch_id'
-                )
-                
-                for photo in photos:
-                    if not photo.original_image:
-                        continue
-                    
+            manifest = None
+            
+            with self.zip_heartbeat():
+                if mode == 'incremental':
                     try:
-                        cloudinary_image = CloudinaryImage(str(photo.original_image))
-                        download_url = cloudinary_image.build_url(
-                            resource_type='image',
-                            type='upload'
-                        )
-                        
-                        # Stream download directly to ZIP without loading into memory
-                        img_response = requests.get(download_url, timeout=30, stream=True)
-                        img_response.raise_for_status()
-                        
-                        # Extract clean filename
-                        public_id_parts = str(photo.original_image).split('/')
-                        base_name = public_id_parts[-1] if public_id_parts else str(photo.id)
-                        filename = f"{photo.id}_{base_name}.jpg"
-                        
-                        # Write streamed content directly to ZIP
-                        with zipf.open(filename, 'w') as zip_entry:
-                            for chunk in img_response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    zip_entry.write(chunk)
-                        
-                    except Exception as e:
-                        print(f"Failed to add photo {photo.id} to ZIP: {e}")
-                        continue
-            
-            # Upload the temp file to Cloudinary
-            with open(temp_zip.name, 'rb') as zip_file:
-                upload_result = uploader.upload(
-                    zip_file,
-                    resource_type='raw',
-                    public_id=f'batch_zips/{self.id}',
-                    format='zip',
-                    overwrite=True
+                        manifest, upload_result = self._update_zip_archive(session, photos, added, removed)
+                    except (ManifestMismatch, zipfile.BadZipFile, requests.RequestException) as e:
+                        logger.warning(f"Incremental ZIP update failed for batch {self.id}, rebuilding: {e}")
+                
+                if manifest is None:
+                    manifest, upload_result = self._build_zip_archive(session, photos)
+            
+            completed = apply_transition(
+                self, COMPLETE_ZIP,
+                zip_file=upload_result['public_id'],
+                zip_manifest=manifest,
+                zip_error=None,
+                zip_error_kind=''
+            )
+            if not completed:
+                # Reclaimed meanwhile: the volumes and the readiness belong to
+                # the build that took over, and our upload replaced its archive
+                return None, None
+            
+            # A single archive replaces any earlier volume set
+            self.delete_zip_volumes()
+            self.mark_ready_to_sell()
+            
+            return True, None
+            
+        except Exception as e:
+            apply_transition(self, FAIL_ZIP, zip_error=str(e), zip_error_kind=classify(e)[0])
+            return False, e
+            
+        finally:
+            session.close()
+    
+    def _build_zip_archive(self, session, photos):
+        """
+        Build a fresh archive of `photos` and upload it chunk by chunk while
+        later entries are still being fetched, without a local copy.
+        Returns (manifest, upload_result).
+        """
+        start_progress(self.id, 'zip', len(photos))
+        return build_zip_upload(
+            photos,
+            zip_upload_options(f'batch_zips/{self.id}'),
+            session,
+            concurrency=settings.ZIP_FETCH_CONCURRENCY,
+            chunk_size=settings.ZIP_UPLOAD_CHUNK_SIZE,
+            filename=f'{self.id}.zip',
+            progress=ProgressTracker(self.id, 'zip')
+        )
+    
+    def _update_zip_archive(self, session, photos, added, removed):
+        """
+        Download the stored archive, append `added` photos and upload the
+        result. With `removed` entries the archive is copied without them
+        (the originals it keeps are not fetched again).
+        Returns (manifest, upload_result).
+        """
+        import tempfile
+        
+        start_progress(self.id, 'zip', len(added))
+        
+        # Appending needs a seekable copy of the current archive
+        temp_paths = []
+        for _ in range(2 if removed else 1):
+            temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
+            temp_zip.close()
+            temp_paths.append(temp_zip.name)
+        archive_path = output_path = temp_paths[0]
+        
+        try:
+            with open(archive_path, 'wb') as archive:
+                download_archive(session, self.zip_file, archive)
+            
+            if removed:
+                output_path = temp_paths[1]
+                with zipfile.ZipFile(archive_path) as source, \
+                        zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    verify_manifest(source, self.zip_manifest)
+                    copy_entries(source, zipf, [name for name in source.namelist() if name not in removed])
+                    write_zip_entries(
+                        zipf, added, session, settings.ZIP_FETCH_CONCURRENCY,
+                        progress=ProgressTracker(self.id, 'zip')
+                    )
+            else:
+                with zipfile.ZipFile(archive_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
+                    verify_manifest(zipf, self.zip_manifest)
+                    write_zip_entries(
+                        zipf, added, session, settings.ZIP_FETCH_CONCURRENCY,
+                        progress=ProgressTracker(self.id, 'zip')
+                    )
+            
+            upload_result = uploader.upload_large(
+                output_path,
+                chunk_size=settings.ZIP_UPLOAD_CHUNK_SIZE,
+                **zip_upload_options(f'batch_zips/{self.id}')
+            )
+            
+            photos_by_name = {photo.zip_entry_name(): photo for photo in photos}
+            manifest = build_manifest(zipf, photos_by_name, os.path.getsize(output_path))
+            return manifest, upload_result
+            
+        finally:
+            # Clean up temp files
+            for path in temp_paths:
+                try:
+                    os.unlink(path)
+                except:
+                    pass
+
+
+class ZipVolume(models.Model):
+    """One size-capped part of a batch ZIP that was split into volumes"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    batch = models.ForeignKey(
+        Batch,
+        on_delete=models.CASCADE,
+        related_name='zip_volumes'
+    )
+    index = models.PositiveIntegerField()
+    photo_ids = models.JSONField(default=list)
+    estimated_bytes = models.PositiveBigIntegerField(default=0)
+    zip_file = CloudinaryField('zip', blank=True, null=True)
+    status = models.CharField(
+        max_length=20,
+        choices=Batch.ZIP_STATUS_CHOICES,
+        default='pending'
+    )
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'index'], name='unique_batch_zip_volume'),
+        ]
+    
+    def __str__(self):
+        return f"{self.batch.title} - part {self.index + 1}"
+    
+    @property
+    def public_id(self):
+        # Unique per volume row: a task left over from a replaced volume set
+        # must not overwrite the archive of its successor
+        return f'batch_zips/{self.batch_id}/part{self.index + 1:03d}_{self.id}'
+    
+    def generate_sync(self):
+        """
+        Build and upload this volume - should only be called from background task.
+        Returns tuple: (success: bool, error: Exception or None); success is
+        None when the volume is already built or was replaced by a newer set.
+        """
+        # Compare-and-set: only a pending (or failed, when retried) volume is built
+        if not ZipVolume.objects.filter(id=self.id, status__in=['pending', 'failed']).update(status='processing'):
+            return None, None
+        self.status = 'processing'
+        
+        photos = Photo.objects.filter(id__in=self.photo_ids).only('id', 'original_image', 'original_version', 'batch_id')
+        session = build_session(pool_size=settings.ZIP_FETCH_CONCURRENCY)
+        
+        try:
+            # Split builds keep the batch lease alive from each volume task
+            with self.batch.zip_heartbeat():
+                _, upload_result = build_zip_upload(
+                    list(photos),
+                    zip_upload_options(self.public_id),
+                    session,
+                    concurrency=settings.ZIP_FETCH_CONCURRENCY,
+                    chunk_size=settings.ZIP_UPLOAD_CHUNK_SIZE,
+                    filename=f'{self.batch_id}_part{self.index + 1:03d}.zip',
+                    progress=ProgressTracker(self.batch_id, 'zip')
                 )
             
+            completed = ZipVolume.objects.filter(id=self.id, status='processing').update(
+                zip_file=upload_result['public_id'], status='completed', error=None
+            )
+            if not completed:
+                # Replaced by a newer volume set while uploading
+                destroy_zip_archives([upload_result['public_id']])
+                return None, None
             self.zip_file = upload_result['public_id']
-            self.zip_status = 'completed'
-            self.zip_error = None
-            self.save(update_fields=['zip_file', 'zip_status', 'zip_error'])
+            self.status = 'completed'
+            self.error = None
             
+            self.batch.finish_zip_volumes()
             return True, None
             
         except Exception as e:
             error_msg = str(e)
-            self.zip_status = 'failed'
-            self.zip_error = error_msg
-            self.save(update_fields=['zip_status', 'zip_error'])
-            return False, error_msg
+            if not ZipVolume.objects.filter(id=self.id, status='processing').update(status='failed', error=error_msg):
+                # A replaced volume's failure says nothing about the batch
+                return None, None
+            self.status = 'failed'
+            self.error = error_msg
+            
+            Batch.objects.filter(id=self.batch_id).update(
+                zip_status='failed',
+                zip_status_changed_at=timezone.now(),
+                zip_error=f"Volume {self.index + 1} failed: {error_msg}",
+                zip_error_kind=classify(e)[0]
+            )
+            rebuild_if_dirty(self.batch_id)
+            return False, e
             
         finally:
-            # Clean up temp file
-            try:
-                os.unlink(temp_zip.name)
-            except:
-                pass
+            session.close()
 
 
 class Photo(models.Model):
@@ -204,13 +635,24 @@ class Photo(models.Model):
         db_index=True
     )
     original_image = CloudinaryField('image')
+    original_bytes = models.PositiveBigIntegerField(blank=True, null=True)
+    # Upload version of the original; a re-upload under the same public_id
+    # gets a new one, which keeps caches and CDN URLs from serving old bytes
+    original_version = models.PositiveBigIntegerField(blank=True, null=True)
     preview_image = CloudinaryField('image', blank=True, null=True)
+    # Watermarked width/format ladder ('local' backend): width, height, format, public_id, url
+    renditions = models.JSONField(default=list, blank=True)
     preview_status = models.CharField(
         max_length=20,
         choices=PREVIEW_STATUS_CHOICES,
         default='pending'
     )
     preview_error = models.TextField(blank=True, null=True)
+    preview_error_kind = models.CharField(max_length=20, choices=ERROR_KIND_CHOICES, blank=True)
+    # Set while preview_status is 'processing'; see photos.reaper
+    preview_started_at = models.DateTimeField(blank=True, null=True)
+    preview_heartbeat_at = models.DateTimeField(blank=True, null=True)
+    preview_status_changed_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -226,21 +668,65 @@ class Photo(models.Model):
     @cached_property
     def preview_url(self):
         """Get preview image URL - computed once per instance"""
-        if self.preview_image:
+        rendition = self.rendition()
+        if rendition:
+            return rendition['url']
+        elif self.preview_image:
             return CloudinaryImage(str(self.preview_image)).build_url()
-        elif self.original_image:
-            return CloudinaryImage(str(self.original_image)).build_url()
+        # Never fall back to the original: it is publicly deliverable
         return None
     
     def thumbnail_url(self, width=300, height=200):
         """Generate thumbnail URL - no caching needed, just string formatting"""
-        public_id = self.preview_image or self.original_image
-        if not public_id:
+        rendition = self.rendition(width, height)
+        if rendition:
+            # Stored rendition: no on-the-fly transformation
+            return rendition['url']
+        
+        if not self.preview_image:
             return None
-        return CloudinaryImage(str(public_id)).build_url(
+        return CloudinaryImage(str(self.preview_image)).build_url(
             width=width, height=height, crop="fill", quality="auto"
         )
     
+    def rendition(self, width=None, height=None, fmt='jpeg'):
+        """
+        Smallest stored rendition covering width x height (the largest one
+        if none does, or if no size is given).
+        """
+        candidates = sorted(
+            (r for r in self.renditions if r['format'] == fmt),
+            key=lambda r: r['width']
+        )
+        if not candidates:
+            return None
+        for candidate in candidates:
+            if width and height and candidate['width'] >= width and candidate['height'] >= height:
+                return candidate
+        return candidates[-1]
+    
+    def rendition_srcset(self, fmt='jpeg'):
+        """`srcset` attribute value listing the stored renditions of a format"""
+        return ', '.join(
+            f"{r['url']} {r['width']}w"
+            for r in sorted(self.renditions, key=lambda r: r['width'])
+            if r['format'] == fmt
+        )
+    
+    @property
+    def jpeg_srcset(self):
+        return self.rendition_srcset('jpeg')
+    
+    @property
+    def webp_srcset(self):
+        return self.rendition_srcset('webp')
+    
+    def zip_entry_name(self):
+        """Filename of this photo inside a batch ZIP"""
+        public_id_parts = str(self.original_image).split('/')
+        base_name = public_id_parts[-1] if public_id_parts else str(self.id)
+        return f"{self.id}_{base_name}.jpg"
+    
     def schedule_preview_generation(self):
         """Queue preview generation as async task"""
         from .tasks import generate_photo_preview
@@ -249,7 +735,8 @@ class Photo(models.Model):
             return
         
         self.preview_status = 'pending'
-        self.save(update_fields=['preview_status'])
+        self.preview_status_changed_at = timezone.now()
+        self.save(update_fields=['preview_status', 'preview_status_changed_at'])
         
         # Queue Celery task
         generate_photo_preview.delay(str(self.id))
@@ -330,62 +817,123 @@ class Photo(models.Model):
     #         self.save(update_fields=['preview_status', 'preview_error'])
     #         return False, error_msg
 
-    def generate_preview_sync(self):
+    PREVIEW_FIELDS = [
+        'preview_image', 'renditions', 'preview_status', 'preview_error',
+        'preview_error_kind',
+    ]
+    
+    def build_preview(self, session):
         """
-        Synchronous preview generation using Cloudinary transformations.
-        Returns tuple: (success: bool, error_message: str or None)
+        Produce the watermarked preview and set the preview fields, without
+        saving. With the 'derived' preview backend Cloudinary copies the eager
+        named transformation to its own preview; the 'local' backend renders
+        the whole rendition ladder with Pillow; otherwise Cloudinary renders
+        the watermarked image, which is uploaded as its own preview.
+        Raises on failure.
         """
-        if not self.original_image:
-            return False, "No original image"
-        
-        self.preview_status = 'processing'
-        self.save(update_fields=['preview_status'])
-        
-        try:
-            # Get the original image URL with transformations applied
-            cloudinary_image = CloudinaryImage(str(self.original_image))
-            
+        if uses_derived_previews():
+            # The derivative was generated eagerly at upload; Cloudinary copies
+            # it from its URL, so no bytes pass through this worker
+            upload_result = uploader.upload(
+                derived_preview_url(
+                    self.original_image, settings.PREVIEW_TRANSFORMATION, version=self.original_version
+                ),
+                public_id=f'previews/{self.id}',
+                folder='previews',
+                resource_type='image',
+                overwrite=True
+            )
+            self.preview_image = upload_result['public_id']
+            self.renditions = []
+        elif uses_local_previews():
+            self.build_renditions(session)
+        else:
             # Build URL with watermark transformations
-            watermarked_url = cloudinary_image.build_url(
-                transformation=[
-                    {'width': 800, 'crop': 'limit'},
-                    {'quality': 'auto:low'},
-                    # Center watermark
-                    {'overlay': {'font_family': 'Arial', 'font_size': 40, 'font_weight': 'bold', 'text': 'DOTNETLENSES'}},
-                    {'flags': 'layer_apply', 'gravity': 'center', 'opacity': 50},
-                    # Top-left watermark
-                    {'overlay': {'font_family': 'Arial', 'font_size': 40, 'font_weight': 'bold', 'text': 'DOTNETLENSES'}},
-                    {'flags': 'layer_apply', 'gravity': 'north_west', 'x': 100, 'y': 100, 'opacity': 50},
-                    # Top-right watermark
-                    {'overlay': {'font_family': 'Arial', 'font_size': 40, 'font_weight': 'bold', 'text': 'DOTNETLENSES'}},
-                    {'flags': 'layer_apply', 'gravity': 'north_east', 'x': 100, 'y': 100, 'opacity': 50},
-                    # Bottom-left watermark
-                    {'overlay': {'font_family': 'Arial', 'font_size': 40, 'font_weight': 'bold', 'text': 'DOTNETLENSES'}},
-                    {'flags': 'layer_apply', 'gravity': 'south_west', 'x': 100, 'y': 100, 'opacity': 50},
-                    # Bottom-right watermark
-                    {'overlay': {'font_family': 'Arial', 'font_size': 40, 'font_weight': 'bold', 'text': 'DOTNETLENSES'}},
-                    {'flags': 'layer_apply', 'gravity': 'south_east', 'x': 100, 'y': 100, 'opacity': 50},
-                ]
+            watermarked_url = CloudinaryImage(str(self.original_image)).build_url(
+                transformation=WATERMARK_TRANSFORMATION,
+                version=self.original_version
             )
             
-            # Download the transformed image
-            response = requests.get(watermarked_url, timeout=30, stream=True)
-            response.raise_for_status()
+            # Download the transformed image (kept in the host cache so a
+            # retry after a failed upload does not fetch it again)
+            watermarked = download_cached(
+                session, watermarked_url, self.original_image,
+                version=self.original_version, variant=watermarked_url
+            )
             
             # Upload it as a new preview image
-            preview_public_id = f'previews/{self.id}'
+            with watermarked:
+                upload_result = uploader.upload(
+                    watermarked,
+                    public_id=f'previews/{self.id}',
+                    folder='previews',
+                    resource_type='image',
+                    overwrite=True
+                )
+            
+            self.preview_image = upload_result['public_id']
+            self.renditions = []
+        
+        self.preview_status = 'completed'
+        self.preview_error = None
+        self.preview_error_kind = ''
+    
+    def build_renditions(self, session):
+        """
+        Decode the (cached) original once, render every configured width and
+        format with Pillow and upload them. The largest rendition of the first
+        format (JPEG by default) doubles as the preview image.
+        Sets the fields without saving.
+        """
+        original = download_cached(
+            session, original_download_url(self.original_image, self.original_version),
+            self.original_image, version=self.original_version
+        )
+        with original:
+            rendered = render_file(
+                render_renditions, original, settings.PREVIEW_RENDER_PROCESSES,
+                WATERMARK_TEXT, settings.PREVIEW_RENDITION_WIDTHS, settings.PREVIEW_RENDITION_FORMATS
+            )
+        
+        renditions = []
+        for rendition in rendered:
             upload_result = uploader.upload(
-                BytesIO(response.content),
-                public_id=preview_public_id,
-                folder='previews',
+                BytesIO(rendition['data']),
+                public_id=f"previews/{self.id}_{rendition['width']}_{rendition['format']}",
                 resource_type='image',
+                format=rendition['format'],
                 overwrite=True
             )
-            
-            self.preview_image = upload_result['public_id']
-            self.preview_status = 'completed'
-            self.preview_error = None
-            self.save(update_fields=['preview_image', 'preview_status', 'preview_error'])
+            renditions.append({
+                'width': rendition['width'],
+                'height': rendition['height'],
+                'format': rendition['format'],
+                'public_id': upload_result['public_id'],
+                'url': upload_result['secure_url'],
+            })
+        
+        # Largest first, in PREVIEW_RENDITION_FORMATS order
+        self.preview_image = renditions[0]['public_id']
+        self.renditions = renditions
+    
+    def generate_preview_sync(self):
+        """
+        Synchronous preview generation using Cloudinary transformations.
+        Returns tuple: (success: bool, error: Exception or None); success is
+        None when another worker is already generating this preview.
+        """
+        if not self.original_image:
+            return False, PermanentError("No original image")
+        
+        if not apply_transition(self, START_PREVIEW):
+            return None, None
+        
+        try:
+            with build_session(pool_size=1) as session:
+                self.build_preview(session)
+            apply_transition(self, COMPLETE_PREVIEW, **{
+                field: getattr(self, field) for field in self.PREVIEW_FIELDS if field != 'preview_status'
+            })
             
             # Invalidate cache
             cache.delete(f'batch_preview_{self.batch_id}')
@@ -393,67 +941,52 @@ class Photo(models.Model):
             return True, None
             
         except Exception as e:
-            error_msg = str(e)
-            self.preview_status = 'failed'
-            self.preview_error = error_msg
-            self.save(update_fields=['preview_status', 'preview_error'])
-            return False, error_msg
+            apply_transition(self, FAIL_PREVIEW, preview_error=str(e), preview_error_kind=classify(e)[0])
+            return False, e
     
-    # def add_watermark(self, img):
-    #     """Add watermark to image - optimized version"""
-    #     # Convert to RGBA only if needed
-    #     if img.mode != 'RGBA':
-    #         img = img.convert('RGBA')
-        
-    #     # Create overlay
-    #     overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    #     draw = ImageDraw.Draw(overlay)
+    @classmethod
+    def generate_previews_sync(cls, photos, concurrency):
+        """
+        Generate the previews of many photos at once: one UPDATE to claim them
+        (processing), concurrent generation over a shared HTTP session and one
+        bulk_update for the results.
+        Photos another worker has already claimed are skipped and left out
+        of the returned list of (photo, Exception or None).
+        """
+        photos = [photo for photo in photos if photo.original_image]
+        if not photos:
+            return []
         
-    #     watermark_text = "PREVIEW"
+        claimed = apply_transition_many(cls.objects.filter(id__in=[photo.id for photo in photos]), START_PREVIEW)
+        photos = [photo for photo in photos if photo.id in claimed]
+        if not photos:
+            return []
+        ids = [photo.id for photo in photos]
         
-    #     # Calculate font size based on image dimensions
-    #     font_size = max(20, min(img.width, img.height) // 20)
+        def build(photo):
+            try:
+                photo.build_preview(session)
+                return photo, None
+            except Exception as e:
+                photo.preview_status = 'failed'
+                photo.preview_error = str(e)
+                photo.preview_error_kind = classify(e)[0]
+                return photo, e
         
-    #     try:
-    #         # Try common font locations
-    #         font_paths = [
-    #             "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",  # Linux
-    #             "/System/Library/Fonts/Helvetica.ttc",  # macOS
-    #             "C:\\Windows\\Fonts\\arial.ttf",  # Windows
-    #         ]
-            
-    #         font = None
-    #         for path in font_paths:
-    #             if os.path.exists(path):
-    #                 font = ImageFont.truetype(path, font_size)
-    #                 break
-            
-    #         if not font:
-    #             font = ImageFont.load_default()
-    #     except:
-    #         font = ImageFont.load_default()
-        
-    #     # Get text dimensions
-    #     bbox = draw.textbbox((0, 0), watermark_text, font=font)
-    #     text_width = bbox[2] - bbox[0]
-    #     text_height = bbox[3] - bbox[1]
-        
-    #     # Add watermarks in grid (optimized spacing)
-    #     spacing_x = text_width + 100
-    #     spacing_y = text_height + 60
-        
-    #     for x in range(-text_width, img.width + text_width, spacing_x):
-    #         for y in range(-text_height, img.height + text_height, spacing_y):
-    #             draw.text(
-    #                 (x, y), 
-    #                 watermark_text, 
-    #                 fill=(255, 255, 255, 128),  # Slightly more visible
-    #                 font=font
-    #             )
+        heartbeat = Heartbeat(cls.objects.filter(id__in=ids, preview_status='processing'), 'preview_heartbeat_at')
+        with heartbeat, build_session(pool_size=concurrency) as session:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='preview') as executor:
+                results = list(executor.map(build, photos))
         
-    #     # Composite and convert back to RGB
-    #     watermarked = Image.alpha_composite(img, overlay)
-    #     return watermarked.convert('RGB')
+        # processing -> completed/failed, for the rows that are still ours
+        now = timezone.now()
+        for photo in photos:
+            photo.preview_status_changed_at = now
+        cls.objects.filter(preview_status='processing').bulk_update(
+            photos, cls.PREVIEW_FIELDS + ['preview_status_changed_at']
+        )
+        cache.delete_many({f'batch_preview_{photo.batch_id}' for photo in photos})
+        return results
     
     # def get_thumbnail_url(self, width=300, height=200):
     #     """Get cached thumbnail URL"""
@@ -0,0 +1,198 @@
+"""
+Local disk cache of originals shared by the worker processes of one host.
+
+Files are content-addressed: the name is a hash of the Cloudinary public_id,
+its version and an optional variant (e.g. a derived transformation), so an
+overwritten upload never serves stale bytes. Entries are written to a temp
+file and renamed into place, which makes them visible atomically to every
+process. Reads bump the file's mtime. The total size is kept in a small
+index file that every fill adds to; only once it exceeds the byte budget is
+the directory walked and the least recently used files evicted, under an
+exclusive lock. The walk also corrects the index.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+from functools import lru_cache
+
+from django.conf import settings
+
+from helpers.metrics import get_metrics, incr_metric
+
+
+logger = logging.getLogger('photos')
+
+LOCK_FILENAME = '.evict.lock'
+SIZE_FILENAME = '.size'
+TEMP_PREFIX = '.tmp-'
+
+# Evictions free space down to this share of the budget, so a full cache
+# is not walked again on the very next fill
+EVICT_TO = 0.9
+
+
+def cache_key(public_id, version=None, variant=None):
+    """Content address of a resource (and optionally one of its variants)"""
+    raw = f'{public_id}\0{version or ""}\0{variant or ""}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class OriginalsCache:
+    """Byte-budgeted LRU cache of downloaded files in `directory`"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def open(self, key):
+        """Open a cached file for reading, or return None on a miss"""
+        path = self.path(key)
+        try:
+            fileobj = open(path, 'rb')
+        except FileNotFoundError:
+            incr_metric('originals_cache_misses')
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted after we opened it; our descriptor stays valid
+            pass
+        incr_metric('originals_cache_hits')
+        return fileobj
+
+    def get_or_download(self, key, download):
+        """
+        Return an open file with the content of `key`, calling
+        `download(fileobj)` to fill the cache on a miss.
+        The caller owns (and must close) the returned file.
+        """
+        cached = self.open(key)
+        if cached is not None:
+            return cached
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path),
+            prefix=TEMP_PREFIX,
+            delete=False
+        )
+        try:
+            with tmp:
+                download(tmp)
+            os.replace(tmp.name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp.name)
+            except FileNotFoundError:
+                pass
+            raise
+
+        # Open before evicting so the new file is readable even if it goes
+        fileobj = open(path, 'rb')
+        total = self._add_size(os.fstat(fileobj.fileno()).st_size)
+        if total is None or total > self.max_bytes:
+            self.evict()
+        return fileobj
+
+    def _update_size(self, update):
+        """
+        Apply `update(total or None)` to the recorded size under the index
+        file's lock and store its result; returns that result.
+        """
+        fd = os.open(os.path.join(self.directory, SIZE_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as size_file:
+            fcntl.flock(size_file, fcntl.LOCK_EX)
+            raw = size_file.read().strip()
+            total = update(int(raw) if raw else None)
+            size_file.seek(0)
+            size_file.truncate()
+            if total is not None:
+                size_file.write(str(total))
+            return total
+
+    def _add_size(self, size):
+        """Count a new file; returns the new total, or None when not known yet"""
+        return self._update_size(lambda total: None if total is None else total + size)
+
+    def evict(self):
+        """Drop least recently used files until the cache fits its budget"""
+        lock_path = os.path.join(self.directory, LOCK_FILENAME)
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is already evicting
+                return 0
+
+            try:
+                return self._evict_locked()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict_locked(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                # Lock, index and temp files
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            self._update_size(lambda _: total)
+            return 0
+
+        evicted = 0
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        # Fills counted during the walk are lost; the next walk corrects it
+        self._update_size(lambda _: total)
+        incr_metric('originals_cache_evictions', evicted)
+        return evicted
+
+
+def originals_cache_stats():
+    """Shared hit/miss/eviction counters and the resulting hit rate"""
+    stats = get_metrics('originals_cache_hits', 'originals_cache_misses', 'originals_cache_evictions')
+    lookups = stats['originals_cache_hits'] + stats['originals_cache_misses']
+    hit_rate = stats['originals_cache_hits'] / lookups * 100 if lookups else 0
+    stats['originals_cache_hit_rate'] = f'{hit_rate:.1f}%'
+    return stats
+
+
+@lru_cache(maxsize=None)
+def get_originals_cache():
+    """The host's originals cache, or None when disabled"""
+    if not settings.ORIGINALS_CACHE_DIR or settings.ORIGINALS_CACHE_MAX_BYTES <= 0:
+        return None
+
+    try:
+        return OriginalsCache(settings.ORIGINALS_CACHE_DIR, settings.ORIGINALS_CACHE_MAX_BYTES)
+    except OSError as e:
+        logger.warning(f'Originals cache disabled: {e}')
+        return None
@@ -0,0 +1,74 @@
+"""
+Watermarked previews.
+
+Three backends, picked with settings.PREVIEW_BACKEND:
+
+- 'cloudinary': a worker downloads the watermarked transformation of the
+  original and uploads it again as its own `previews/{id}` image.
+- 'local': a worker downloads the original and renders a ladder of
+  watermarked renditions with Pillow (photos.watermark), uploaded as
+  `previews/{id}_{width}_{format}`; the largest JPEG doubles as the preview.
+- 'derived': the watermark is the named transformation
+  settings.PREVIEW_TRANSFORMATION, generated eagerly at upload time. A worker
+  has Cloudinary copy that derivative to `previews/{id}` by uploading it from
+  its URL, so no image bytes pass through the worker. Create the named
+  transformation once with `manage.py create_preview_transformation`.
+
+Previews never reference an original's public_id: originals use the public
+`upload` delivery type, so stripping the transformation from any derived URL
+of an original would serve it unwatermarked.
+"""
+from django.conf import settings
+from cloudinary import CloudinaryImage
+
+
+WATERMARK_TEXT = 'DOTNETLENSES'
+
+
+def _watermark_layer(**placement):
+    return [
+        {'overlay': {'font_family': 'Arial', 'font_size': 40, 'font_weight': 'bold', 'text': WATERMARK_TEXT}},
+        {'flags': 'layer_apply', 'opacity': 50, **placement},
+    ]
+
+
+WATERMARK_TRANSFORMATION = [
+    {'width': 800, 'crop': 'limit'},
+    {'quality': 'auto:low'},
+    # Center watermark
+    *_watermark_layer(gravity='center'),
+    # Corner watermarks
+    *_watermark_layer(gravity='north_west', x=100, y=100),
+    *_watermark_layer(gravity='north_east', x=100, y=100),
+    *_watermark_layer(gravity='south_west', x=100, y=100),
+    *_watermark_layer(gravity='south_east', x=100, y=100),
+]
+
+
+def uses_derived_previews():
+    return settings.PREVIEW_BACKEND == 'derived'
+
+
+def uses_local_previews():
+    return settings.PREVIEW_BACKEND == 'local'
+
+
+def preview_upload_options():
+    """Extra upload options for originals: eagerly generate the derived preview"""
+    if not uses_derived_previews():
+        return {}
+    return {
+        'eager': [{'transformation': settings.PREVIEW_TRANSFORMATION}],
+        'eager_async': True,
+    }
+
+
+def derived_preview_url(public_id, transformation, version=None):
+    """
+    URL of the named preview transformation of an original, used as the
+    upload source of its preview. Signed, so it passes strict transformations.
+    Never hand it to clients: it reveals the original's public_id.
+    """
+    return CloudinaryImage(str(public_id)).build_url(
+        transformation=[{'transformation': transformation}], version=version, sign_url=True
+    )
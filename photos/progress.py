@@ -0,0 +1,108 @@
+"""
+Live per-batch progress of the preview and ZIP pipelines.
+
+Counters live in the Redis-backed Django cache so every worker can add to
+them (a split ZIP is built by several tasks at once) and the admin can read
+them without touching the database. Trackers batch their increments and
+flush at most once per PROGRESS_FLUSH_INTERVAL, keeping the fetch loops cheap.
+"""
+import time
+
+from django.core.cache import cache
+
+
+STAGES = ('previews', 'zip')
+
+PROGRESS_TTL = 6 * 60 * 60
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+
+def _key(batch_id, stage, field):
+    return f'progress:{batch_id}:{stage}:{field}'
+
+
+def start_progress(batch_id, stage, total):
+    """Reset a stage's counters for a run over `total` photos"""
+    cache.set_many({
+        _key(batch_id, stage, 'meta'): {'total': total, 'started_at': time.time()},
+        _key(batch_id, stage, 'done'): 0,
+        _key(batch_id, stage, 'bytes'): 0,
+    }, timeout=PROGRESS_TTL)
+
+
+def record_progress(batch_id, stage, photos=1, nbytes=0):
+    """Add to a stage's counters right away"""
+    for field, amount in (('done', photos), ('bytes', nbytes)):
+        if not amount:
+            continue
+        try:
+            cache.incr(_key(batch_id, stage, field), amount)
+        except ValueError:
+            # No run started (or it expired): nothing to report to
+            return
+
+
+class ProgressTracker:
+    """Accumulates progress locally and flushes it in periodic increments"""
+
+    def __init__(self, batch_id, stage, flush_interval=PROGRESS_FLUSH_INTERVAL):
+        self.batch_id = batch_id
+        self.stage = stage
+        self.flush_interval = flush_interval
+        self._photos = 0
+        self._bytes = 0
+        self._last_flush = time.monotonic()
+
+    def advance(self, photos=1, nbytes=0):
+        self._photos += photos
+        self._bytes += nbytes
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._photos or self._bytes:
+            record_progress(self.batch_id, self.stage, self._photos, self._bytes)
+        self._photos = self._bytes = 0
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def get_progress(batch_id, stage):
+    """
+    Snapshot of a stage: photos done out of total, bytes written and the
+    estimated seconds left. Returns None when no run has been recorded.
+    """
+    keys = [_key(batch_id, stage, field) for field in ('meta', 'done', 'bytes')]
+    values = cache.get_many(keys)
+    meta = values.get(keys[0])
+    if not meta:
+        return None
+
+    total = meta['total']
+    done = min(values.get(keys[1], 0), total)
+    elapsed = time.time() - meta['started_at']
+
+    if total and done >= total:
+        eta = 0
+    elif done:
+        eta = round(elapsed / done * (total - done))
+    else:
+        eta = None
+
+    return {
+        'done': done,
+        'total': total,
+        'bytes': values.get(keys[2], 0),
+        'percent': round(done / total * 100) if total else 100,
+        'eta_seconds': eta,
+    }
+
+
+def get_batch_progress(batch_id):
+    """Progress of every pipeline stage of a batch"""
+    return {stage: get_progress(batch_id, stage) for stage in STAGES}
@@ -0,0 +1,89 @@
+"""
+Reclaim work whose worker died while it was marked 'processing'.
+
+Jobs stamp a started_at column when they begin and keep a heartbeat column
+fresh while they run (photos.locks.Heartbeat). A row still 'processing'
+without a heartbeat for PROCESSING_LEASE_TIMEOUT has lost its worker: the
+reaper puts it back to 'pending' with one UPDATE and requeues it. Rows
+without any heartbeat predate these columns and count as expired too.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Batch, Photo
+
+
+def lease_cutoff():
+    return timezone.now() - timedelta(seconds=settings.PROCESSING_LEASE_TIMEOUT)
+
+
+def expired_photos(cutoff=None):
+    cutoff = cutoff or lease_cutoff()
+    return Photo.objects.filter(
+        Q(preview_heartbeat_at__lt=cutoff) | Q(preview_heartbeat_at__isnull=True),
+        preview_status='processing'
+    )
+
+
+def expired_batches(cutoff=None):
+    """
+    A split build only heartbeats while a volume task runs, so a batch whose
+    volumes are still queued behind other work is not expired: reclaiming it
+    would replace the volume rows under the queued tasks.
+    """
+    cutoff = cutoff or lease_cutoff()
+    return Batch.objects.filter(
+        Q(zip_heartbeat_at__lt=cutoff) | Q(zip_heartbeat_at__isnull=True),
+        zip_status='processing'
+    ).exclude(zip_volumes__status='pending')
+
+
+def expired_ingests(cutoff=None):
+    cutoff = cutoff or lease_cutoff()
+    return Batch.objects.filter(
+        Q(ingest_heartbeat_at__lt=cutoff) | Q(ingest_heartbeat_at__isnull=True),
+        ingest_status='processing'
+    )
+
+
+def _reclaim(queryset, limit, **reset):
+    """
+    Lock up to `limit` expired rows (skipping rows another reaper holds),
+    reset them with one UPDATE and return their ids.
+    """
+    with transaction.atomic():
+        ids = list(
+            queryset.select_for_update(skip_locked=True)
+            .order_by()
+            .values_list('id', flat=True)[:limit]
+        )
+        if ids:
+            queryset.model.objects.filter(id__in=ids).update(**reset)
+    return ids
+
+
+def reclaim_photos(limit):
+    """Put expired preview jobs back to 'pending'; returns their ids"""
+    return _reclaim(
+        expired_photos(), limit,
+        preview_status='pending', preview_status_changed_at=timezone.now(),
+        preview_started_at=None, preview_heartbeat_at=None
+    )
+
+
+def reclaim_batches(limit):
+    """Put expired ZIP builds back to 'pending'; returns their ids"""
+    return _reclaim(
+        expired_batches(), limit,
+        zip_status='pending', zip_status_changed_at=timezone.now(),
+        zip_started_at=None, zip_heartbeat_at=None
+    )
+
+
+def reclaim_ingests(limit):
+    """Put expired ingests of staged uploads back to 'pending'; returns their ids"""
+    return _reclaim(expired_ingests(), limit, ingest_status='pending', ingest_heartbeat_at=None)
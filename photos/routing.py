@@ -0,0 +1,42 @@
+"""
+Celery queue routing for the photo pipelines.
+
+- images: preview generation, I/O bound (thread pool workers)
+- cpu: preview generation with the local Pillow backend (prefork workers)
+- heavy: ZIP builds and upload ingests, long running and I/O bound (thread pool workers)
+- orchestration: short fan-out and scheduling tasks
+
+Unrouted tasks stay on Celery's default queue.
+"""
+from django.conf import settings
+
+
+DEFAULT_QUEUE = 'celery'
+QUEUES = ('orchestration', 'images', 'cpu', 'heavy')
+
+TASK_QUEUES = {
+    'photos.tasks.generate_photo_preview': 'images',
+    'photos.tasks.generate_photo_previews': 'images',
+    'photos.tasks.generate_batch_zip': 'heavy',
+    'photos.tasks.generate_zip_volume': 'heavy',
+    'photos.tasks.ingest_batch_upload': 'heavy',
+    'photos.tasks.process_batch_upload': 'orchestration',
+    'photos.tasks.flush_zip_rebuild': 'orchestration',
+    'photos.tasks.publish_preview_requeue': 'orchestration',
+    'photos.tasks.retry_failed_previews': 'orchestration',
+    'photos.tasks.reclaim_stuck_processing': 'orchestration',
+    'photos.tasks.cleanup_old_cache': 'orchestration',
+}
+
+
+def preview_queue():
+    """Queue preview tasks go to: rendering locally makes them CPU bound"""
+    return 'cpu' if settings.PREVIEW_BACKEND == 'local' else 'images'
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router (see task_routes in photobiz/celery.py)"""
+    queue = TASK_QUEUES.get(name)
+    if queue == 'images':
+        queue = preview_queue()
+    return {'queue': queue} if queue else None
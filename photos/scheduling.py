@@ -0,0 +1,255 @@
+"""
+Scheduling of background work: debounced batch ZIP rebuilds, chunking of
+preview generation and budgeted bulk re-enqueueing of previews.
+
+ZIP rebuilds are debounced: every request pushes the batch's rebuild
+deadline back by ZIP_REBUILD_QUIET_PERIOD seconds. Only the first request
+of a burst queues a flush task; the flush re-queues itself until the batch
+has been quiet for the whole period and then runs exactly one
+generate_batch_zip. State lives in the Redis-backed Django cache so every web and worker
+process sees the same schedule.
+
+A rebuild that finds a build already running does not queue another one:
+it marks the batch dirty once (mark_zip_dirty), and whoever finishes the
+running build requests a single follow-up (rebuild_if_dirty).
+
+Retries and admin regenerations go through requeue_previews: one UPDATE,
+then chunked task groups whose start is spread out by a shared token bucket
+(RETRY_BUDGET_RATE photos per second, bursts of RETRY_BUDGET_BURST), so a
+mass retry queues behind the budget instead of in front of new uploads.
+Chunks are scheduled at most RETRY_BUDGET_HORIZON seconds ahead, since the
+Redis broker redelivers messages whose ETA is beyond its visibility timeout;
+the rest is published later by publish_preview_requeue.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+
+RETRY_BUDGET_KEY = 'retry_budget:previews'
+
+# Token bucket as a "theoretical arrival time" (GCRA): reserving n tokens
+# pushes the time at which the bucket is full again by n / rate seconds.
+# Returns {1, wait} with how long the caller must wait before using its
+# tokens, or {0, excess} without reserving anything if that wait would be
+# more than `horizon` seconds (excess: how much sooner it would need to be).
+RESERVE_TOKENS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local horizon = tonumber(ARGV[4])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or '0'), now) + cost
+local wait = tat - burst - now
+if wait > horizon then
+    return {0, tostring(wait - horizon)}
+end
+redis.call('SET', KEYS[1], tostring(tat), 'EX', math.ceil(tat - now) + 1)
+return {1, tostring(math.max(0, wait))}
+"""
+
+
+def _deadline_key(batch_id):
+    return f'zip_rebuild:{batch_id}:deadline'
+
+
+def _scheduled_key(batch_id):
+    return f'zip_rebuild:{batch_id}:scheduled'
+
+
+def _requests_key(batch_id):
+    return f'zip_rebuild:{batch_id}:requests'
+
+
+def _dirty_key(batch_id):
+    return f'zip_rebuild:{batch_id}:dirty'
+
+
+# Outlives any build; a mark left by a dead build must not linger forever
+DIRTY_TTL = 24 * 60 * 60
+
+
+def _ttl():
+    # Outlives the flush chain; if a flush is lost the next request reschedules
+    return settings.ZIP_REBUILD_QUIET_PERIOD * 4 + 60
+
+
+def request_zip_rebuild(batch_id):
+    """
+    Ask for the batch ZIP to be rebuilt once things settle down.
+    Returns True if this call queued the flush task.
+    """
+    from .tasks import flush_zip_rebuild
+
+    quiet_period = settings.ZIP_REBUILD_QUIET_PERIOD
+    cache.set(_deadline_key(batch_id), time.time() + quiet_period, timeout=_ttl())
+
+    cache.add(_requests_key(batch_id), 0, timeout=_ttl())
+    try:
+        cache.incr(_requests_key(batch_id))
+    except ValueError:
+        # Key expired between add and incr; the count is informational only
+        pass
+
+    if not cache.add(_scheduled_key(batch_id), True, timeout=_ttl()):
+        return False
+
+    flush_zip_rebuild.apply_async((str(batch_id),), countdown=quiet_period)
+    return True
+
+
+def seconds_until_rebuild(batch_id):
+    """Remaining quiet time before the batch may be rebuilt (0 when due)"""
+    deadline = cache.get(_deadline_key(batch_id))
+    if deadline is None:
+        return 0
+    return max(0, deadline - time.time())
+
+
+def defer_zip_rebuild(batch_id):
+    """Keep the schedule alive while a flush waits for the quiet period"""
+    cache.touch(_scheduled_key(batch_id), _ttl())
+
+
+def claim_zip_rebuild(batch_id):
+    """
+    Clear the schedule so later requests start a new burst.
+    Returns how many requests were coalesced into this rebuild.
+    """
+    coalesced = cache.get(_requests_key(batch_id)) or 0
+    cache.delete_many([
+        _scheduled_key(batch_id),
+        _deadline_key(batch_id),
+        _requests_key(batch_id),
+    ])
+    return coalesced
+
+
+def cancel_zip_rebuild(batch_id):
+    """Forget any scheduled or pending rebuild of a batch, e.g. once it is deleted"""
+    cache.delete_many([
+        _scheduled_key(batch_id),
+        _deadline_key(batch_id),
+        _requests_key(batch_id),
+        _dirty_key(batch_id),
+    ])
+
+
+def mark_zip_dirty(batch_id, build_running):
+    """
+    Record that the batch changed while a build is running, for that build
+    to pick up when it finishes. `build_running` is checked after marking:
+    if the build finished meanwhile it may have missed the mark, so the
+    rebuild is requested here instead.
+    Returns True if the batch was not marked yet.
+    """
+    marked = cache.add(_dirty_key(batch_id), True, timeout=DIRTY_TTL)
+    if not build_running():
+        rebuild_if_dirty(batch_id)
+    return marked
+
+
+def rebuild_if_dirty(batch_id):
+    """
+    Called when a build finishes: request one follow-up rebuild if the
+    batch changed while it ran. Returns True if it did.
+    """
+    if not cache.delete(_dirty_key(batch_id)):
+        return False
+    request_zip_rebuild(batch_id)
+    return True
+
+
+def plan_preview_chunks(photo_ids):
+    """
+    Split photo ids into chunks for generate_photo_previews.
+    With an idle queue the photos are spread over PREVIEW_WORKER_SLOTS
+    messages so every worker gets some; the deeper the backlog, the fewer
+    free slots and the bigger the chunks, which cuts per-message overhead.
+    """
+    from helpers.monitoring import get_queue_depth
+    from .routing import preview_queue
+
+    photo_ids = list(photo_ids)
+    if not photo_ids:
+        return []
+
+    depth = get_queue_depth(preview_queue()) or 0
+    slots = max(1, settings.PREVIEW_WORKER_SLOTS - depth)
+    size = math.ceil(len(photo_ids) / slots)
+    size = min(max(size, settings.PREVIEW_CHUNK_MIN), settings.PREVIEW_CHUNK_MAX)
+
+    return [photo_ids[i:i + size] for i in range(0, len(photo_ids), size)]
+
+
+def reserve_retry_budget(count, horizon):
+    """
+    Take `count` photos from the retry budget, unless they would have to
+    wait more than `horizon` seconds.
+    Returns (reserved, seconds): the delay before they may be queued (0
+    within the burst), or, if nothing was reserved, how long until the
+    budget would reserve them.
+    """
+    rate = settings.RETRY_BUDGET_RATE
+    redis = get_redis_connection('default')
+    reserved, seconds = redis.eval(
+        RESERVE_TOKENS_SCRIPT, 1, RETRY_BUDGET_KEY,
+        time.time(), count / rate, settings.RETRY_BUDGET_BURST / rate, horizon
+    )
+    return bool(reserved), float(seconds)
+
+
+def publish_previews(photo_ids):
+    """
+    Publish generate_photo_previews chunks for `photo_ids` paced by the
+    retry budget, none scheduled more than RETRY_BUDGET_HORIZON ahead. Once
+    the budget is booked beyond that, the remaining photos are handed to
+    publish_preview_requeue for when it catches up.
+    Returns the number of photos published now.
+    """
+    from celery import group
+    from .tasks import generate_photo_previews, publish_preview_requeue
+
+    horizon = settings.RETRY_BUDGET_HORIZON
+    chunks = plan_preview_chunks(photo_ids)
+    signatures = []
+    published = 0
+    for position, chunk in enumerate(chunks):
+        reserved, seconds = reserve_retry_budget(len(chunk), horizon)
+        if not reserved:
+            remaining = [photo_id for rest in chunks[position:] for photo_id in rest]
+            # Come back once half the horizon has been freed, not per chunk
+            publish_preview_requeue.apply_async((remaining,), countdown=min(max(seconds, horizon / 2), horizon))
+            break
+        signatures.append(generate_photo_previews.s(chunk).set(countdown=seconds))
+        published += len(chunk)
+
+    if signatures:
+        group(signatures).apply_async()
+    return published
+
+
+def requeue_previews(queryset, **reset):
+    """
+    Reset the previews of the photos in `queryset` to 'pending' (plus any
+    `reset` field values) with a single UPDATE, then publish them as chunked
+    generate_photo_previews groups paced by the retry budget.
+    Returns the number of photos queued.
+    """
+    # Filtered here rather than in SQL: `queryset` may be sliced
+    photo_ids = [
+        str(photo_id) for photo_id, original_image in queryset.values_list('id', 'original_image')
+        if original_image
+    ]
+    if not photo_ids:
+        return 0
+
+    queryset.model.objects.filter(id__in=photo_ids).update(
+        preview_status='pending', preview_status_changed_at=timezone.now(), **reset
+    )
+
+    publish_previews(photo_ids)
+    return len(photo_ids)
@@ -10,7 +10,7 @@ class PhotoSerializer(serializers.ModelSerializer):
     
     def get_preview_url(self, obj):
         if obj.preview_image:
-            return obj.preview_image.url
+            return obj.preview_url
         return None
 
 class BatchListSerializer(serializers.ModelSerializer):
@@ -1,25 +1,38 @@
+from django.db.models import QuerySet
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from .models import Photo, Batch
+from .scheduling import cancel_zip_rebuild, request_zip_rebuild
+
+# The stored ZIP and its manifest are kept when photos change, so the next
+# generate_batch_zip can append/drop entries instead of rebuilding everything.
 
 @receiver(post_save, sender=Photo)
 def photo_saved(sender, instance, created, **kwargs):
-    """When a photo is saved, regenerate batch zip if needed"""
+    """When a photo is saved, mark the batch zip as out of date"""
     if created:
-        # Clear existing zip file so it gets regenerated with new photo
-        if instance.batch.zip_file:
-            instance.batch.zip_file = None
-            instance.batch.save(update_fields=['zip_file'])
+        Batch.objects.filter(
+            id=instance.batch_id,
+            zip_status='completed'
+        ).update(zip_status='pending', zip_status_changed_at=timezone.now())
 
 @receiver(post_delete, sender=Photo)
-def photo_deleted(sender, instance, **kwargs):
-    """When a photo is deleted, regenerate batch zip"""
-    if instance.batch_id:
-        try:
-            batch = Batch.objects.get(id=instance.batch_id)
-            if batch.zip_file:
-                batch.zip_file = None
-                batch.save(update_fields=['zip_file'])
-        except Batch.DoesNotExist:
-            pass
+def photo_deleted(sender, instance, origin=None, **kwargs):
+    """When a photo is deleted, mark the batch zip as out of date and rebuild it"""
+    # Photos deleted along with their batch leave nothing to rebuild
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if instance.batch_id and origin_model is not Batch:
+        Batch.objects.filter(
+            id=instance.batch_id,
+            zip_status='completed'
+        ).update(zip_status='pending', zip_status_changed_at=timezone.now())
+        
+        # Debounced: deleting many photos at once triggers a single rebuild
+        request_zip_rebuild(instance.batch_id)
+
 
+@receiver(post_delete, sender=Batch)
+def batch_deleted(sender, instance, **kwargs):
+    """Drop rebuilds requested before the batch was deleted"""
+    cancel_zip_rebuild(instance.id)
@@ -0,0 +1,81 @@
+"""
+Compare-and-set status transitions for preview and ZIP processing.
+
+Each transition is a single conditional UPDATE (... WHERE status IN
+sources), so when two deliveries of the same task race, exactly one of them
+moves the row and learns it won; the other skips the work. Every transition
+also stamps the status's changed_at column (and the started_at/heartbeat
+columns when work starts, see photos.reaper).
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+
+Transition = namedtuple('Transition', ['field', 'sources', 'target', 'stamps'])
+
+PREVIEW_STAMP = 'preview_status_changed_at'
+ZIP_STAMP = 'zip_status_changed_at'
+
+START_PREVIEW = Transition(
+    'preview_status', ('pending', 'failed'), 'processing',
+    (PREVIEW_STAMP, 'preview_started_at', 'preview_heartbeat_at')
+)
+COMPLETE_PREVIEW = Transition('preview_status', ('processing',), 'completed', (PREVIEW_STAMP,))
+FAIL_PREVIEW = Transition('preview_status', ('processing',), 'failed', (PREVIEW_STAMP,))
+
+START_ZIP = Transition(
+    'zip_status', ('pending', 'failed', 'completed'), 'processing',
+    (ZIP_STAMP, 'zip_started_at', 'zip_heartbeat_at')
+)
+COMPLETE_ZIP = Transition('zip_status', ('processing',), 'completed', (ZIP_STAMP,))
+# A new upload run makes a finished (or failed) ZIP out of date
+RESET_ZIP = Transition('zip_status', ('failed', 'completed'), 'pending', (ZIP_STAMP,))
+FAIL_ZIP = Transition('zip_status', ('processing',), 'failed', (ZIP_STAMP,))
+
+
+def _values(step, fields):
+    now = timezone.now()
+    values = {stamp: now for stamp in step.stamps}
+    values.update(fields)
+    values[step.field] = step.target
+    return values
+
+
+def apply_transition(instance, step, **fields):
+    """
+    Move `instance` along `step` (setting `fields` as well) if its stored
+    status is one of the step's sources. Returns True if this call won; the
+    instance is then updated in memory too.
+    """
+    values = _values(step, fields)
+    won = type(instance).objects.filter(
+        pk=instance.pk,
+        **{f'{step.field}__in': step.sources}
+    ).update(**values)
+
+    if won:
+        for name, value in values.items():
+            setattr(instance, name, value)
+    return bool(won)
+
+
+def apply_transition_many(queryset, step, **fields):
+    """
+    Move every row of `queryset` that is in one of the step's sources and
+    not locked by a concurrent claim. Returns the set of primary keys won.
+    """
+    with transaction.atomic():
+        pks = set(
+            queryset.filter(**{f'{step.field}__in': step.sources})
+            .select_for_update(skip_locked=True)
+            .order_by()
+            .values_list('pk', flat=True)
+        )
+        if pks:
+            queryset.model.objects.filter(
+                pk__in=pks,
+                **{f'{step.field}__in': step.sources}
+            ).update(**_values(step, fields))
+    return pks
@@ -1,6 +1,24 @@
-from celery import shared_task, group, chord
+import logging
+import os
+
+from celery import shared_task, group
+from django.conf import settings
 from django.core.cache import cache
-from .models import Batch, Photo
+from .models import Batch, Photo, ZipVolume
+from .barrier import arrive, barrier_batch_id, barrier_failures, open_barrier
+from .errors import PERMANENT, backoff_delay, classify, dead_letter, retry_or_dead_letter
+from .ingest import create_photos, discard_staged, staged_files, staging_storage, upload_staged
+from .locks import zip_build_lease
+from .progress import record_progress, start_progress
+from .reaper import lease_cutoff, reclaim_batches, reclaim_ingests, reclaim_photos
+from .scheduling import (
+    claim_zip_rebuild, defer_zip_rebuild, mark_zip_dirty, plan_preview_chunks, publish_previews,
+    rebuild_if_dirty, request_zip_rebuild, requeue_previews, seconds_until_rebuild,
+)
+from helpers.metrics import incr_metric
+
+
+logger = logging.getLogger('photos')
 
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
@@ -9,14 +27,21 @@ def generate_photo_preview(self, photo_id):
     Background task to generate photo preview with watermark.
     Retries up to 3 times on failure.
     """
+    photo = None
     try:
         photo = Photo.objects.get(id=photo_id)
         success, error = photo.generate_preview_sync()
         
+        if success is None:
+            # Another delivery of this task is generating it
+            return {
+                'photo_id': photo_id,
+                'status': 'skipped'
+            }
         if not success:
-            # Retry on failure
-            raise Exception(f"Preview generation failed: {error}")
+            raise error
         
+        record_progress(photo.batch_id, 'previews')
         return {
             'photo_id': photo_id,
             'status': 'success'
@@ -29,8 +54,91 @@ def generate_photo_preview(self, photo_id):
             'status': 'not_found'
         }
     except Exception as e:
-        # Retry on any other error
-        raise self.retry(exc=e)
+        giving_up = classify(e)[0] == PERMANENT or self.request.retries >= self.max_retries
+        if photo is not None and giving_up:
+            # Giving up on this photo still moves the batch towards done
+            record_progress(photo.batch_id, 'previews')
+        # Backoff by error kind; permanent failures are dead-lettered
+        retry_or_dead_letter(self, e)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, ignore_result=True)
+def generate_photo_previews(self, photo_ids, barrier_id=None, queue_zip=True):
+    """
+    Background task to generate the previews of a chunk of photos.
+    Photos that fail transiently are retried (up to 3 times, with backoff) as
+    a smaller chunk; permanent failures and photos out of retries are
+    dead-lettered and the task still succeeds so the batch can move on.
+    Finished photos arrive at `barrier_id`; the chunk completing the barrier
+    marks the batch previews done and, with `queue_zip`, queues its ZIP.
+    """
+    photos = list(Photo.objects.filter(id__in=photo_ids))
+    results = Photo.generate_previews_sync(photos, concurrency=settings.PREVIEW_CONCURRENCY)
+    
+    failed = [(photo, error, classify(error)) for photo, error in results if error]
+    retryable = []
+    if self.request.retries < self.max_retries:
+        retryable = [entry for entry in failed if entry[2][0] != PERMANENT]
+    retry_ids = {str(photo.id) for photo, _, _ in retryable}
+    
+    # Photos that are done (or given up on) move their batch towards done
+    for photo, error in results:
+        if str(photo.id) not in retry_ids:
+            record_progress(photo.batch_id, 'previews')
+    
+    for photo, error, (kind, _) in failed:
+        if str(photo.id) not in retry_ids:
+            dead_letter(self.name, [[str(photo.id)]], error, kind)
+    
+    if barrier_id:
+        failed_ids = {str(photo.id) for photo, _, _ in failed}
+        # Photos claimed by another worker arrive when that worker is done
+        processed = {str(photo.id) for photo, _ in results}
+        skipped = {str(photo.id) for photo in photos if photo.original_image} - processed
+        # Deleted photos will never finish: let them through as well
+        arrived = {str(photo_id) for photo_id in photo_ids} - failed_ids - skipped
+        fired = arrive(barrier_id, failed_ids - retry_ids, failed=True)
+        fired = arrive(barrier_id, arrived) or fired
+        
+        if fired:
+            batch_id = barrier_batch_id(barrier_id)
+            failures = barrier_failures(barrier_id)
+            if failures:
+                logger.warning("Batch %s previews done with %d failure(s)", batch_id, failures)
+            
+            batch = Batch.objects.only('id').filter(id=batch_id).first()
+            if batch:
+                batch.mark_previews_completed()
+            if queue_zip:
+                generate_batch_zip.delay(batch_id)
+        elif fired is None and queue_zip:
+            # Barrier expired: fall back to a debounced rebuild
+            request_zip_rebuild(barrier_batch_id(barrier_id))
+    elif not retryable:
+        # Requeued without a barrier (e.g. reclaimed): finish upload runs
+        # still waiting for these photos
+        for batch in Batch.objects.filter(
+            id__in={photo.batch_id for photo in photos},
+            processing_started_at__isnull=False,
+            previews_completed_at__isnull=True
+        ):
+            if batch.mark_previews_completed_if_done() and batch.processing_pipeline != 'parallel':
+                request_zip_rebuild(batch.id)
+    
+    if retryable:
+        # Wait as long as the most demanding Retry-After in the chunk
+        retry_after = max((after for _, _, (_, after) in retryable if after is not None), default=None)
+        raise self.retry(
+            args=[sorted(retry_ids)],
+            countdown=backoff_delay(self.request.retries, self.default_retry_delay, retry_after),
+            exc=Exception(f"Preview generation failed for {len(retryable)} photo(s): {retryable[0][1]}")
+        )
+    
+    return {
+        'photo_count': len(photo_ids),
+        'completed': len(results) - len(failed),
+        'failed': [str(photo.id) for photo, _, _ in failed]
+    }
 
 
 @shared_task(bind=True, max_retries=2, default_retry_delay=120)
@@ -38,13 +146,44 @@ def generate_batch_zip(self, batch_id):
     """
     Background task to generate ZIP file for a batch.
     Retries up to 2 times on failure.
+    Only one build per batch runs at a time; duplicates exit early, leaving
+    the running build a note to rebuild once more when it finishes.
     """
+    lease = zip_build_lease(batch_id)
+    if not lease.acquire():
+        incr_metric('zip_build_duplicates_skipped')
+        mark_zip_dirty(batch_id, build_running=lease.held)
+        return {
+            'batch_id': batch_id,
+            'status': 'duplicate'
+        }
+    
+    # A split build goes on in the volume tasks after the lease is released
+    # and picks up the dirty mark itself when it finishes
+    handed_off = False
     try:
         batch = Batch.objects.get(id=batch_id)
+        
+        # Batches above ZIP_VOLUME_MAX_BYTES are split and built in parallel
+        volumes = batch.plan_zip_volumes()
+        if len(volumes) > 1:
+            if not batch.start_zip_volume_build(volumes):
+                handed_off = True
+                return _zip_build_in_flight(batch_id)
+            handed_off = True
+            return {
+                'batch_id': batch_id,
+                'status': 'split',
+                'volume_count': len(volumes)
+            }
+        
         success, error = batch.generate_zip_file_sync()
         
+        if success is None:
+            handed_off = True
+            return _zip_build_in_flight(batch_id)
         if not success:
-            raise Exception(f"ZIP generation failed: {error}")
+            raise error
         
         return {
             'batch_id': batch_id,
@@ -57,30 +196,269 @@ def generate_batch_zip(self, batch_id):
             'status': 'not_found'
         }
     except Exception as e:
-        raise self.retry(exc=e)
+        retry_or_dead_letter(self, e)
+    finally:
+        lease.release()
+        if not handed_off:
+            rebuild_if_dirty(batch_id)
+
+
+def _zip_build_in_flight(batch_id):
+    """
+    A ZIP transition was lost: a split build's volume tasks are still running
+    (START_ZIP), or the batch was reclaimed and rebuilt while this build ran
+    (COMPLETE_ZIP). Either way the other build's archive may not be current,
+    so have it rebuild once more when it finishes.
+    """
+    mark_zip_dirty(
+        batch_id,
+        build_running=lambda: Batch.objects.filter(id=batch_id, zip_status='processing').exists()
+    )
+    return {
+        'batch_id': batch_id,
+        'status': 'skipped'
+    }
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=120)
+def generate_zip_volume(self, batch_id, index, volume_id=None):
+    """
+    Background task to build one volume of a split batch ZIP.
+    Retries up to 2 times on failure. A task for a volume set that has been
+    replaced by a newer build finds no volume and exits.
+    """
+    if volume_id is None:
+        # Queued before volumes were addressed by id
+        volume_id = ZipVolume.objects.filter(batch_id=batch_id, index=index).values_list('id', flat=True).first()
+        if volume_id is None:
+            return {
+                'batch_id': batch_id,
+                'index': index,
+                'status': 'not_found'
+            }
+    
+    lease = zip_build_lease(batch_id, volume_id=volume_id)
+    if not lease.acquire():
+        incr_metric('zip_build_duplicates_skipped')
+        return {
+            'batch_id': batch_id,
+            'index': index,
+            'status': 'duplicate'
+        }
+    
+    try:
+        volume = ZipVolume.objects.select_related('batch').get(id=volume_id, batch_id=batch_id)
+        success, error = volume.generate_sync()
+        
+        if success is None:
+            # Already built, or replaced by a newer volume set
+            return {
+                'batch_id': batch_id,
+                'index': index,
+                'status': 'skipped'
+            }
+        if not success:
+            raise error
+        
+        return {
+            'batch_id': batch_id,
+            'index': index,
+            'status': 'success'
+        }
+        
+    except ZipVolume.DoesNotExist:
+        return {
+            'batch_id': batch_id,
+            'index': index,
+            'status': 'not_found'
+        }
+    except Exception as e:
+        retry_or_dead_letter(self, e)
+    finally:
+        lease.release()
+
+
+@shared_task
+def flush_zip_rebuild(batch_id):
+    """
+    Runs the debounced ZIP rebuild of a batch once it has been quiet for
+    ZIP_REBUILD_QUIET_PERIOD seconds (see photos.scheduling).
+    """
+    remaining = seconds_until_rebuild(batch_id)
+    if remaining > 0:
+        # More changes arrived meanwhile: wait for the new deadline
+        defer_zip_rebuild(batch_id)
+        flush_zip_rebuild.apply_async((batch_id,), countdown=remaining)
+        return {
+            'batch_id': batch_id,
+            'status': 'deferred',
+            'countdown': remaining
+        }
+    
+    coalesced = claim_zip_rebuild(batch_id)
+    generate_batch_zip.delay(batch_id)
+    
+    return {
+        'batch_id': batch_id,
+        'status': 'queued',
+        'coalesced_requests': coalesced
+    }
+
+
+@shared_task
+def publish_preview_requeue(photo_ids):
+    """
+    Publishes the rest of a paced preview requeue once the retry budget has
+    caught up (see photos.scheduling.publish_previews).
+    """
+    published = publish_previews(photo_ids)
+    
+    return {
+        'status': 'published',
+        'published': published,
+        'deferred': len(photo_ids) - published
+    }
 
 
 @shared_task
 def process_batch_upload(batch_id, photo_ids):
     """
-    Orchestrates preview generation for multiple photos and then ZIP generation.
-    Uses Celery's chord to wait for all previews before creating ZIP.
+    Orchestrates preview generation for multiple photos and ZIP generation.
+    Photos are sent in chunks sized to the current queue depth; each chunk
+    checks in at a completion barrier (see photos/barrier.py) and the last
+    one to finish marks the previews done. No per-photo results are stored.
+    
+    The ZIP only needs the originals, so with BATCH_PIPELINE = 'parallel'
+    it is built alongside the previews; otherwise the last preview chunk
+    queues it. The batch records when it became ready to sell either way.
     """
-    # Create a group of preview generation tasks
-    preview_tasks = group(
-        generate_photo_preview.s(photo_id) for photo_id in photo_ids
-    )
+    try:
+        batch = Batch.objects.only('id').get(id=batch_id)
+    except Batch.DoesNotExist:
+        return {
+            'batch_id': batch_id,
+            'status': 'not_found'
+        }
+    
+    parallel = settings.BATCH_PIPELINE == 'parallel'
+    batch.start_processing('parallel' if parallel else 'sequential')
+    start_progress(batch_id, 'previews', len(photo_ids))
+    
+    if parallel or not photo_ids:
+        generate_batch_zip.delay(batch_id)
+    
+    if not photo_ids:
+        batch.mark_previews_completed()
+        return {
+            'batch_id': batch_id,
+            'photo_count': 0,
+            'chunk_count': 0,
+        }
     
-    # # Use chord: run all previews in parallel, then generate ZIP when done
-    # result = chord(preview_tasks)(generate_batch_zip.s(batch_id))
+    chunks = plan_preview_chunks(photo_ids)
+    barrier_id = open_barrier(batch_id, photo_ids)
+    
+    group(
+        generate_photo_previews.s(chunk, barrier_id=barrier_id, queue_zip=not parallel)
+        for chunk in chunks
+    ).apply_async()
+    
+    return {
+        'batch_id': batch_id,
+        'photo_count': len(photo_ids),
+        'chunk_count': len(chunks),
+        'barrier_id': barrier_id
+    }
 
-    # Use chord with immutable signature (si) so results aren't passed to callback
-    result = chord(preview_tasks)(generate_batch_zip.si(batch_id))
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def ingest_batch_upload(self, batch_id, staged_names):
+    """
+    Upload staged admin uploads to Cloudinary (ADMIN_UPLOAD_CONCURRENCY at a
+    time), record them as photos and start their processing.
+    
+    Files are taken INGEST_SLICE_SIZE at a time: a slice's photos are created
+    and its staged files deleted before the next slice starts, so a retry or
+    a reclaim after a crash only repeats the slice that was in flight.
+    Transient upload failures are retried with backoff; refused files are
+    dropped and counted as failed, and so are files the worker cannot find
+    in the staging storage once nothing is left staged.
+    """
+    try:
+        batch = Batch.objects.only('id').get(id=batch_id)
+    except Batch.DoesNotExist:
+        return {
+            'batch_id': batch_id,
+            'status': 'not_found'
+        }
+    
+    if not batch.begin_ingest():
+        return {
+            'batch_id': batch_id,
+            'status': 'skipped'
+        }
+    
+    # Files no longer staged were ingested by an earlier delivery, or were
+    # staged where this worker cannot see them
+    storage = staging_storage()
+    names = [name for name in staged_names if storage is not None and storage.exists(name)]
+    photo_ids = []
+    retryable = []
+    last_error = None
+    
+    with batch.ingest_heartbeat():
+        for start in range(0, len(names), settings.INGEST_SLICE_SIZE):
+            uploaded = []
+            refused = []
+            error = None
+            for name, result in upload_staged(
+                batch_id, names[start:start + settings.INGEST_SLICE_SIZE], settings.ADMIN_UPLOAD_CONCURRENCY
+            ):
+                if not isinstance(result, Exception):
+                    uploaded.append((name, result))
+                    continue
+                
+                error = f'{os.path.basename(name)}: {type(result).__name__}: {result}'
+                if classify(result)[0] == PERMANENT:
+                    refused.append(name)
+                else:
+                    retryable.append(name)
+                    last_error = result
+            
+            created = create_photos(batch_id, [result for _, result in uploaded])
+            photo_ids += [str(photo.id) for photo in created]
+            discard_staged([name for name, _ in uploaded] + refused)
+            batch.record_ingest(uploaded=len(uploaded), failed=len(refused), error=error)
+    
+    if photo_ids:
+        process_batch_upload.delay(batch_id, photo_ids)
+    
+    if retryable:
+        if self.request.retries >= self.max_retries:
+            # Left in staging so the ingest can be resumed from the admin
+            batch.fail_ingest(len(retryable), f'{type(last_error).__name__}: {last_error}')
+        retry_or_dead_letter(self, last_error, args=(batch_id, retryable))
+    
+    missing = len(staged_names) - len(names)
+    if not staged_files(batch_id) and batch.abandon_ingest(
+        'Staged files not found; the staging storage must be shared by web and workers'
+    ):
+        # Nothing left to ingest, yet files are unaccounted for: complete the
+        # ingest instead of leaving it for the reaper to requeue forever
+        logger.warning(f'Ingest of batch {batch_id} gave up on files missing from the staging storage')
+        return {
+            'batch_id': batch_id,
+            'status': 'incomplete',
+            'photo_count': len(photo_ids),
+            'failed_count': len(staged_names) - len(photo_ids),
+            'missing_count': missing
+        }
     
     return {
         'batch_id': batch_id,
+        'status': 'success',
         'photo_count': len(photo_ids),
-        'task_id': result.id
+        'failed_count': len(staged_names) - len(photo_ids)
     }
 
 
@@ -89,22 +467,65 @@ def retry_failed_previews():
     """
     Periodic task to retry failed preview generations.
     Run this via Celery Beat (e.g., every hour).
+    Permanent failures are left alone (see the dead-letter list).
     """
     failed_photos = Photo.objects.filter(
         preview_status='failed',
         preview_image__isnull=True
-    )[:50]  # Process 50 at a time
+    ).exclude(preview_error_kind=PERMANENT)[:50]  # Process 50 at a time
     
-    retry_count = 0
-    for photo in failed_photos:
-        photo.schedule_preview_generation()
-        retry_count += 1
+    retry_count = requeue_previews(failed_photos)
     
     return {
         'retried_count': retry_count
     }
 
 
+@shared_task
+def reclaim_stuck_processing():
+    """
+    Periodic task to requeue previews, ZIP builds and upload ingests whose
+    worker died (no heartbeat for PROCESSING_LEASE_TIMEOUT, see photos/reaper.py).
+    Run this via Celery Beat (e.g., every 5 minutes). Each run reclaims at
+    most PROCESSING_REAP_PHOTOS photos and PROCESSING_REAP_BATCHES batches,
+    so recovering from a mass failure does not flood the queues.
+    """
+    photo_ids = [str(photo_id) for photo_id in reclaim_photos(settings.PROCESSING_REAP_PHOTOS)]
+    chunks = plan_preview_chunks(photo_ids) if photo_ids else []
+    if chunks:
+        group(generate_photo_previews.s(chunk) for chunk in chunks).apply_async()
+    
+    batch_ids = reclaim_batches(settings.PROCESSING_REAP_BATCHES)
+    for batch_id in batch_ids:
+        # Debounced and lease-guarded like any other rebuild
+        request_zip_rebuild(batch_id)
+    
+    ingest_ids = reclaim_ingests(settings.PROCESSING_REAP_BATCHES)
+    if ingest_ids:
+        # Files staged since the lease expired belong to ingests still queued
+        cutoff = lease_cutoff()
+        for batch_id in ingest_ids:
+            ingest_batch_upload.delay(str(batch_id), staged_files(batch_id, older_than=cutoff))
+        # Photos the dead ingest recorded but never queued for previews
+        requeue_previews(Photo.objects.filter(batch_id__in=ingest_ids, preview_status='pending'))
+    
+    if photo_ids or batch_ids or ingest_ids:
+        logger.warning(
+            f'Reclaimed {len(photo_ids)} preview(s), {len(batch_ids)} ZIP build(s) '
+            f'and {len(ingest_ids)} ingest(s) stuck in processing'
+        )
+        incr_metric('reclaimed_previews', len(photo_ids))
+        incr_metric('reclaimed_zip_builds', len(batch_ids))
+        incr_metric('reclaimed_ingests', len(ingest_ids))
+    
+    return {
+        'reclaimed_previews': len(photo_ids),
+        'reclaimed_zip_builds': len(batch_ids),
+        'reclaimed_ingests': len(ingest_ids),
+        'chunk_count': len(chunks)
+    }
+
+
 @shared_task
 def cleanup_old_cache():
     """
@@ -0,0 +1,113 @@
+"""
+Streaming upload handler for the batch admin.
+
+Originals posted to the batch admin's bulk_upload field are forwarded to a
+Cloudinary chunked upload while the request body is still arriving. Nothing
+is spooled to a temporary file and nothing is read twice; memory stays
+bounded by the chunked writer (a few ADMIN_UPLOAD_CHUNK_SIZE chunks per
+file). The form then receives StreamedUpload objects that carry the upload
+results (see photos.ingest.upload_original).
+
+Only used with ADMIN_UPLOAD_MODE = 'stream'; by default the admin uploads
+the files once the request has been received. Every other request and field
+falls through to Django's default handlers.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .ingest import MAX_ORIGINAL_BYTES, UploadRejected, original_upload_options
+from .uploads import ChunkedUploadWriter, StreamedUpload
+
+
+STREAMED_FIELD = 'bulk_upload'
+STREAMED_VIEWS = {'admin:photos_batch_add', 'admin:photos_batch_change'}
+
+
+class BatchUploadHandler(FileUploadHandler):
+    """Uploads the batch admin's bulk_upload files to Cloudinary as they arrive"""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.enabled = False
+        self.writer = None
+        self.error = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        match = getattr(self.request, 'resolver_match', None)
+        self.enabled = (
+            settings.ADMIN_UPLOAD_MODE == 'stream'
+            and match is not None and match.view_name in STREAMED_VIEWS
+        )
+
+    def upload_batch_id(self):
+        """
+        The batch the originals belong to. A batch being added has no id
+        yet; one is reserved on the request and used by the admin's save.
+        """
+        object_id = self.request.resolver_match.kwargs.get('object_id')
+        if object_id:
+            return object_id
+        if not hasattr(self.request, 'upload_batch_id'):
+            self.request.upload_batch_id = uuid.uuid4()
+        return self.request.upload_batch_id
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if not (self.enabled and field_name == STREAMED_FIELD and file_name):
+            return
+
+        self.error = None
+        self.writer = ChunkedUploadWriter(
+            original_upload_options(self.upload_batch_id()),
+            chunk_size=settings.ADMIN_UPLOAD_CHUNK_SIZE,
+            max_pending=1,
+            filename=file_name
+        )
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+
+        if self.error is None:
+            if start + len(raw_data) > MAX_ORIGINAL_BYTES:
+                self.error = UploadRejected(f'File too large (max {MAX_ORIGINAL_BYTES // 1024 // 1024}MB)')
+                self.writer.abort()
+            else:
+                try:
+                    self.writer.write(raw_data)
+                except Exception as e:
+                    # Keep consuming the body; the failure is reported per file
+                    self.error = e
+                    self.writer.abort()
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+
+        writer, self.writer = self.writer, None
+        result = None
+        if file_size == 0:
+            # Rejected as empty by the form; there is nothing to upload
+            writer.abort()
+        elif self.error is None:
+            try:
+                result = writer.close()
+            except Exception as e:
+                self.error = e
+
+        return StreamedUpload(
+            name=self.file_name,
+            size=file_size,
+            content_type=self.content_type,
+            result=result,
+            error=self.error
+        )
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
@@ -0,0 +1,148 @@
+"""Chunked uploads to Cloudinary that overlap with producing the data"""
+import queue
+import threading
+
+from cloudinary import uploader, utils
+from django.core.files.uploadedfile import UploadedFile
+
+
+# Cloudinary requires every chunk but the last to be at least 5MB
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 20 * 1024 * 1024
+
+
+class ChunkedUploadError(Exception):
+    """A chunk could not be uploaded; the whole upload has to be restarted"""
+
+
+class ChunkedUploadWriter:
+    """
+    Write-only, unseekable file object that uploads its content as a
+    Cloudinary chunked ("upload_large") upload on a background thread.
+
+    Full chunks are handed to the upload thread as soon as they are written,
+    so the producer and the upload run at the same time. At most
+    `max_pending` chunks wait for upload; after that `write` blocks, which
+    bounds memory at roughly (max_pending + 2) * chunk_size.
+    Nothing is written to local disk.
+    """
+
+    def __init__(self, upload_options, chunk_size=DEFAULT_CHUNK_SIZE, max_pending=2, filename='stream'):
+        self.upload_options = dict(upload_options)
+        self.chunk_size = max(chunk_size, MIN_CHUNK_SIZE)
+        self.filename = filename
+        self.result = None
+
+        self._buffer = bytearray()
+        self._position = 0
+        self._error = None
+        self._closed = False
+        self._upload_id = utils.random_public_id()
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = threading.Thread(target=self._run, name='chunked-upload', daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        self._raise_if_failed()
+        self._buffer += data
+        self._position += len(data)
+
+        # Keep the tail back: the final chunk has to carry the total size
+        while len(self._buffer) > self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            self._put((chunk, False))
+
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Upload the final chunk, wait for the upload and return its result"""
+        if self._closed:
+            return self.result
+        self._closed = True
+
+        self._put((bytes(self._buffer), True))
+        self._buffer.clear()
+        self._put(None)
+        self._thread.join()
+        self._raise_if_failed()
+        return self.result
+
+    def abort(self):
+        """Stop uploading; chunks already sent are discarded by Cloudinary"""
+        if self._closed:
+            return
+        self._closed = True
+        self._error = self._error or ChunkedUploadError("Upload aborted")
+        self._buffer.clear()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # The upload thread stops at its next chunk since _error is set
+            pass
+
+    def _put(self, item):
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        start = 0
+        while True:
+            item = self._queue.get()
+            if item is None or self._error is not None:
+                return
+
+            chunk, last = item
+            end = start + len(chunk) - 1
+            total = end + 1 if last else -1
+            try:
+                result = uploader.upload_large_part(
+                    (self.filename, chunk),
+                    http_headers={
+                        'Content-Range': f'bytes {start}-{end}/{total}',
+                        'X-Unique-Upload-Id': self._upload_id,
+                    },
+                    **self.upload_options
+                )
+            except Exception as e:
+                self._error = ChunkedUploadError(f"Chunk upload failed: {e}")
+                self._error.__cause__ = e
+                continue
+
+            start = end + 1
+            if last:
+                self.result = result
+
+
+class StreamedUpload(UploadedFile):
+    """
+    A request file that was uploaded to Cloudinary while it was received
+    (see photos.upload_handlers). Holds the upload result, or the exception
+    that stopped the upload, instead of the file's content.
+    """
+
+    def __init__(self, name, size, content_type=None, result=None, error=None):
+        super().__init__(file=None, name=name, content_type=content_type, size=size)
+        self.result = result
+        self.error = error
+
+    def open(self, mode=None):
+        raise ValueError("The content of a streamed upload is already in storage")
+
+    def close(self):
+        pass
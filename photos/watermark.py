@@ -0,0 +1,232 @@
+"""
+Local Pillow watermark engine used by the 'local' preview backend.
+
+JPEG originals are decoded in draft mode, letting libjpeg scale the DCT by
+1/2, 1/4 or 1/8 so a 50 MP camera file is never fully decoded for an 800 px
+preview; other formats are shrunk with reduce() before the final resample.
+The tiled watermark for a given output size and font is drawn once into a
+transparent RGBA layer and kept in an LRU cache; each preview is then a
+resize plus a single alpha_composite. A whole rendition ladder (several
+widths, JPEG and WebP) comes out of one decode: the largest size is
+watermarked and each smaller one is downscaled from it. Rendering runs in a process pool so
+it scales across cores. This module has no Django or network dependencies,
+so pool workers start cheaply and it can be exercised offline.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import ExifTags, Image, ImageDraw, ImageFont, ImageOps
+
+
+PREVIEW_MAX_WIDTH = 800
+PREVIEW_QUALITY = 85
+
+# Pillow format name and save options per rendition format
+RENDITION_ENCODINGS = {
+    'jpeg': ('JPEG', {'quality': PREVIEW_QUALITY, 'optimize': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+# Shrink by integer factors while the image is at least this many times the
+# target size, then resample with LANCZOS (see Image.resize)
+REDUCING_GAP = 3.0
+WATERMARK_FILL = (255, 255, 255, 128)
+
+# EXIF orientations whose stored pixels are rotated by 90 degrees
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",  # Linux
+    "/System/Library/Fonts/Helvetica.ttc",  # macOS
+    "C:\\Windows\\Fonts\\arial.ttf",  # Windows
+]
+
+
+@lru_cache(maxsize=16)
+def load_font(size):
+    """First available TrueType font at `size`, or Pillow's default font"""
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+    return ImageFont.load_default()
+
+
+def font_size_for(width, height):
+    return max(20, min(width, height) // 20)
+
+
+@lru_cache(maxsize=32)
+def watermark_layer(width, height, text, font_size):
+    """
+    Transparent layer with `text` tiled over a width x height canvas.
+    Cached: callers must treat the returned image as read-only.
+    """
+    layer = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(layer)
+    font = load_font(font_size)
+
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    text_width, text_height = right - left, bottom - top
+
+    # Draw a single tile, then repeat it with paste instead of drawing text
+    # in a nested loop
+    spacing_x = text_width + 100
+    spacing_y = text_height + 60
+    tile = Image.new('RGBA', (spacing_x, spacing_y), (255, 255, 255, 0))
+    ImageDraw.Draw(tile).text((-left, -top), text, fill=WATERMARK_FILL, font=font)
+
+    for x in range(0, width, spacing_x):
+        for y in range(0, height, spacing_y):
+            layer.paste(tile, (x, y))
+    return layer
+
+
+def watermarked_image(source, text, max_width=PREVIEW_MAX_WIDTH, reduce_on_load=True):
+    """
+    Decode an image (path or bytes) at most `max_width` wide, turned upright
+    per its EXIF orientation, and apply the tiled watermark. Returns an RGB image.
+    `reduce_on_load=False` forces a full decode (for benchmarking).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    with Image.open(source) as img:
+        # Size the output by the displayed orientation; pixels are stored
+        # sideways for EXIF orientations 5-8
+        swapped = img.getexif().get(ExifTags.Base.Orientation, 1) in TRANSPOSED_ORIENTATIONS
+        width, height = (img.height, img.width) if swapped else img.size
+        target = None
+        if width > max_width:
+            target = (max_width, max(1, int(height * max_width / width)))
+            if reduce_on_load:
+                # JPEG only: decode at the smallest DCT scale still >= target
+                img.draft('RGB', target[::-1] if swapped else target)
+        # Loads the (drafted) pixels upright
+        img = ImageOps.exif_transpose(img)
+
+    if target:
+        if reduce_on_load:
+            img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        else:
+            img = img.resize(target, Image.Resampling.LANCZOS)
+    img = img.convert('RGBA')
+
+    layer = watermark_layer(img.width, img.height, text, font_size_for(img.width, img.height))
+    return Image.alpha_composite(img, layer).convert('RGB')
+
+
+def encode(img, fmt):
+    pil_format, options = RENDITION_ENCODINGS[fmt]
+    output = BytesIO()
+    img.save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+def render_preview(source, text, max_width=PREVIEW_MAX_WIDTH, reduce_on_load=True):
+    """Watermarked JPEG preview of an image (path or bytes), as bytes"""
+    return encode(watermarked_image(source, text, max_width, reduce_on_load), 'jpeg')
+
+
+def render_renditions(source, text, widths, formats):
+    """
+    Decode an image once and produce its watermarked rendition ladder.
+    Widths larger than the image collapse into one rendition at its own size.
+    Returns a list of dicts (width, height, format, data), largest first.
+    """
+    widths = sorted(set(widths), reverse=True)
+    img = watermarked_image(source, text, max_width=widths[0])
+
+    renditions = []
+    produced = set()
+    for width in widths:
+        width = min(width, img.width)
+        if width in produced:
+            continue
+        produced.add(width)
+
+        if width < img.width:
+            # Downscale from the previous (next larger) rendition
+            img = img.resize(
+                (width, max(1, round(img.height * width / img.width))),
+                Image.Resampling.LANCZOS,
+                reducing_gap=REDUCING_GAP
+            )
+        for fmt in formats:
+            renditions.append({
+                'width': img.width,
+                'height': img.height,
+                'format': fmt,
+                'data': encode(img, fmt),
+            })
+    return renditions
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(processes):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn' rather than fork: callers render from several threads
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _pool
+
+
+def _discard_pool(pool):
+    """Replace a broken pool on next use (other threads may have done it already)"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_pool(processes, render, source, *args):
+    pool = _get_pool(processes)
+    try:
+        return pool.submit(render, source, *args).result()
+    except BrokenProcessPool:
+        # A render process died (e.g. OOM-killed by a huge original), which
+        # breaks the whole pool for good: retry once in a fresh one
+        _discard_pool(pool)
+        return _get_pool(processes).submit(render, source, *args).result()
+
+
+def render_file(render, fileobj, processes, *args):
+    """
+    Call `render(source, *args)` on an open image file, in the process pool
+    when possible. Files with a path on disk are handed over by name instead
+    of copying their bytes to the worker process.
+    Daemonic processes (e.g. Celery prefork children) cannot start a pool,
+    so they, and `processes` <= 0, render inline.
+    """
+    path = getattr(fileobj, 'name', None)
+    source = path if isinstance(path, str) and os.path.isfile(path) else fileobj.read()
+
+    if processes <= 0 or multiprocessing.current_process().daemon:
+        return render(source, *args)
+
+    try:
+        return _run_in_pool(processes, render, source, *args)
+    except FileNotFoundError:
+        # Evicted from the originals cache meanwhile; our descriptor still reads
+        fileobj.seek(0)
+        return _run_in_pool(processes, render, fileobj.read(), *args)
+
+
+def render_preview_file(fileobj, text, processes):
+    """Watermarked JPEG preview of an open image file (see render_file)"""
+    return render_file(render_preview, fileobj, processes, text)
@@ -0,0 +1,118 @@
+// Direct uploads from the batch admin: the browser sends originals straight
+// to Cloudinary with signed parameters from the admin, then registers the
+// uploaded public_ids with the batch in one request.
+(function () {
+    'use strict';
+
+    function csrfToken() {
+        var input = document.querySelector('input[name=csrfmiddlewaretoken]');
+        return input ? input.value : '';
+    }
+
+    function uploadFile(root, file) {
+        return fetch(root.dataset.signatureUrl, { credentials: 'same-origin' })
+            .then(function (response) {
+                if (!response.ok) throw new Error('could not get an upload signature');
+                return response.json();
+            })
+            .then(function (signed) {
+                var form = new FormData();
+                Object.keys(signed.fields).forEach(function (key) {
+                    form.append(key, signed.fields[key]);
+                });
+                form.append('file', file);
+                return fetch(signed.url, { method: 'POST', body: form });
+            })
+            .then(function (response) {
+                return response.json().then(function (result) {
+                    if (!response.ok) throw new Error(result.error ? result.error.message : response.statusText);
+                    return {
+                        public_id: result.public_id,
+                        version: result.version,
+                        signature: result.signature,
+                        bytes: result.bytes
+                    };
+                });
+            });
+    }
+
+    function register(root, uploads) {
+        return fetch(root.dataset.registerUrl, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken() },
+            body: JSON.stringify({ uploads: uploads })
+        }).then(function (response) {
+            if (!response.ok) throw new Error('could not register the uploads');
+            return response.json();
+        });
+    }
+
+    function start(root) {
+        var input = root.querySelector('input[type=file]');
+        var button = root.querySelector('button');
+        var status = root.querySelector('[data-upload-status]');
+        var files = Array.prototype.slice.call(input.files);
+        var maxBytes = parseInt(root.dataset.maxBytes, 10);
+        var concurrency = parseInt(root.dataset.concurrency, 10) || 1;
+        var uploads = [];
+        var failed = [];
+        var next = 0;
+        var done = 0;
+
+        files = files.filter(function (file) {
+            if (file.size <= maxBytes) return true;
+            failed.push(file.name + ' (too large)');
+            return false;
+        });
+        if (!files.length) {
+            status.textContent = failed.length ? 'Nothing to upload: ' + failed.join(', ') : 'No files selected';
+            return;
+        }
+
+        function report() {
+            status.textContent = 'Uploaded ' + done + ' / ' + files.length
+                + (failed.length ? ', ' + failed.length + ' failed' : '');
+        }
+
+        // Each worker takes the next file until none are left
+        function worker() {
+            if (next >= files.length) return Promise.resolve();
+            var file = files[next++];
+            return uploadFile(root, file)
+                .then(function (upload) { uploads.push(upload); done++; })
+                .catch(function (error) { failed.push(file.name + ' (' + error.message + ')'); })
+                .then(function () { report(); return worker(); });
+        }
+
+        button.disabled = true;
+        input.disabled = true;
+        report();
+
+        var workers = [];
+        for (var i = 0; i < Math.min(concurrency, files.length); i++) workers.push(worker());
+
+        Promise.all(workers)
+            .then(function () {
+                if (!uploads.length) throw new Error('no file was uploaded');
+                status.textContent = 'Registering ' + uploads.length + ' photo(s)...';
+                return register(root, uploads);
+            })
+            .then(function () {
+                // The batch page shows the result and the processing progress
+                window.location.reload();
+            })
+            .catch(function (error) {
+                status.textContent = 'Upload failed: ' + error.message
+                    + (failed.length ? '. Failed files: ' + failed.join(', ') : '');
+                button.disabled = false;
+                input.disabled = false;
+            });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('[data-direct-upload]').forEach(function (root) {
+            root.querySelector('button').addEventListener('click', function () { start(root); });
+        });
+    });
+})();
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from photos.watermark import render_preview
+
+
+def _peak_rss_kb():
+    """
+    Peak resident set size of this process in KB. VmHWM is reset by exec,
+    unlike ru_maxrss which a spawned child inherits from its parent.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(path, reduce_on_load, runs, results):
+    """Runs in a fresh process so the peak RSS reflects this mode only"""
+    baseline = _peak_rss_kb()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        render_preview(path, 'BENCHMARK', reduce_on_load=reduce_on_load)
+        timings.append(time.perf_counter() - start)
+    results.put((timings, _peak_rss_kb() - baseline))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark local preview rendering: JPEG draft/reduce-on-load vs full decode'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            type=str,
+            help='JPEG original to render (default: a synthetic camera-sized image)',
+        )
+        parser.add_argument(
+            '--megapixels',
+            type=int,
+            default=48,
+            help='Size of the synthetic original (default: 48)',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='Renders per mode (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        synthetic = None
+
+        if source is None:
+            synthetic = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+            synthetic.close()
+            source = synthetic.name
+            self._make_original(source, options['megapixels'])
+        elif not os.path.isfile(source):
+            raise CommandError(f'No such file: {source}')
+
+        try:
+            with Image.open(source) as img:
+                self.stdout.write(
+                    f'Original: {img.width}x{img.height} {img.format}, '
+                    f'{os.path.getsize(source) / 1024 / 1024:.1f} MB, {options["runs"]} runs per mode\n'
+                )
+
+            context = multiprocessing.get_context('spawn')
+            baseline = None
+            for label, reduce_on_load in (('full decode', False), ('draft + reduce', True)):
+                results = context.Queue()
+                process = context.Process(target=_measure, args=(source, reduce_on_load, options['runs'], results))
+                process.start()
+                timings, peak_kb = results.get()
+                process.join()
+
+                average = sum(timings) / len(timings)
+                baseline = baseline or average
+                self.stdout.write(
+                    f'  {label:<15} {average * 1000:7.0f} ms/image  '
+                    f'peak +{peak_kb / 1024:6.0f} MB  x{baseline / average:.1f}'
+                )
+        finally:
+            if synthetic:
+                os.unlink(synthetic.name)
+
+    def _make_original(self, path, megapixels):
+        """Noisy 3:2 JPEG so the encoder cannot cheat on flat areas"""
+        width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+        height = width * 2 // 3
+        noise = Image.effect_noise((width, height), 48)
+        gradient = Image.linear_gradient('L').resize((width, height))
+        Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.ROTATE_180))).save(
+            path, format='JPEG', quality=90
+        )
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from photos.fetching import build_session, download_to_spool, fetch_in_order, DOWNLOAD_CHUNK_SIZE
+
+
+class FakeOriginHandler(BaseHTTPRequestHandler):
+    """Serves fixed-size fake originals after a simulated origin latency"""
+    payload = b''
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ZIP building against a local fake origin at several fetch concurrencies'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--photos',
+            type=int,
+            default=100,
+            help='Number of originals in the fake batch (default: 100)',
+        )
+        parser.add_argument(
+            '--size-kb',
+            type=int,
+            default=2048,
+            help='Size of each original in KB (default: 2048)',
+        )
+        parser.add_argument(
+            '--latency-ms',
+            type=int,
+            default=150,
+            help='Simulated origin latency per request (default: 150)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=str,
+            default='1,4,8,16',
+            help='Comma separated fetch concurrencies to compare (default: 1,4,8,16)',
+        )
+
+    def handle(self, *args, **options):
+        FakeOriginHandler.payload = os.urandom(options['size_kb'] * 1024)
+        FakeOriginHandler.latency = options['latency_ms'] / 1000
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOriginHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+        urls = [f'http://{host}:{port}/{i}.jpg' for i in range(options['photos'])]
+
+        self.stdout.write(
+            f"Fake origin: {options['photos']} x {options['size_kb']} KB, "
+            f"{options['latency_ms']} ms latency\n"
+        )
+
+        try:
+            baseline = None
+            for concurrency in [int(c) for c in options['concurrency'].split(',')]:
+                elapsed, written = self._build_zip(urls, concurrency)
+                baseline = baseline or elapsed
+                self.stdout.write(
+                    f'  concurrency={concurrency:<3} {elapsed:6.2f}s  '
+                    f'{written / elapsed / 1024 / 1024:7.1f} MB/s  '
+                    f'x{baseline / elapsed:.1f}'
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _build_zip(self, urls, concurrency):
+        """Same fetch/write loop as Batch.generate_zip_file_sync, minus Cloudinary"""
+        session = build_session(pool_size=concurrency)
+        written = 0
+
+        with tempfile.NamedTemporaryFile(suffix='.zip') as temp_zip:
+            start = time.perf_counter()
+            with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                fetched = fetch_in_order(
+                    urls, lambda url: download_to_spool(session, url), concurrency
+                )
+                for index, (url, original) in enumerate(fetched):
+                    if isinstance(original, Exception):
+                        raise original
+                    with original, zipf.open(f'{index}.jpg', 'w') as zip_entry:
+                        shutil.copyfileobj(original, zip_entry, DOWNLOAD_CHUNK_SIZE)
+                    written += len(FakeOriginHandler.payload)
+            elapsed = time.perf_counter() - start
+
+        session.close()
+        return elapsed, written
@@ -34,6 +34,8 @@ class Command(BaseCommand):
         db_public_ids.update(
             Photo.objects.values_list('preview_image', flat=True)
         )
+        for renditions in Photo.objects.exclude(renditions=[]).values_list('renditions', flat=True):
+            db_public_ids.update(rendition['public_id'] for rendition in renditions)
         db_public_ids = {str(pid) for pid in db_public_ids if pid}
         
         self.stdout.write(f'Found {len(db_public_ids)} images in database')
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from cloudinary import api
+from cloudinary.utils import generate_transformation_string
+from photos.previews import WATERMARK_TRANSFORMATION
+
+
+class Command(BaseCommand):
+    help = 'Create (or update) the named Cloudinary transformation used by derived previews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--name',
+            type=str,
+            default=settings.PREVIEW_TRANSFORMATION,
+            help=f'Transformation name (default: {settings.PREVIEW_TRANSFORMATION})',
+        )
+
+    def handle(self, *args, **options):
+        name = options['name']
+        definition, _ = generate_transformation_string(transformation=WATERMARK_TRANSFORMATION)
+
+        self.stdout.write(f'Transformation: {name}')
+        self.stdout.write(f'Definition: {definition}\n')
+
+        try:
+            api.transformation(name)
+            exists = True
+        except api.NotFound:
+            exists = False
+        except Exception as e:
+            raise CommandError(f'Could not look up transformation: {e}')
+
+        try:
+            if exists:
+                # Existing derivatives keep their old look until invalidated
+                api.update_transformation(name, unsafe_update=definition, allowed_for_strict=True)
+                self.stdout.write(self.style.SUCCESS(f'✓ Updated transformation {name}'))
+            else:
+                api.create_transformation(name, definition)
+                api.update_transformation(name, allowed_for_strict=True)
+                self.stdout.write(self.style.SUCCESS(f'✓ Created transformation {name}'))
+        except Exception as e:
+            raise CommandError(f'Could not save transformation: {e}')
+
+        if settings.PREVIEW_BACKEND != 'derived':
+            self.stdout.write(self.style.WARNING(
+                "PREVIEW_BACKEND is not 'derived'; set it to serve previews from this transformation"
+            ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from photos.errors import clear_dead_letters, get_dead_letters
+
+
+class Command(BaseCommand):
+    help = 'List (or clear) background tasks that failed permanently or ran out of retries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=50,
+            help='Number of most recent dead letters to show (default: 50)',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Remove every dead letter',
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            count = clear_dead_letters()
+            self.stdout.write(self.style.SUCCESS(f'✓ Cleared {count} dead letter(s)'))
+            return
+
+        entries = get_dead_letters(options['limit'])
+        if not entries:
+            self.stdout.write(self.style.SUCCESS('No dead letters'))
+            return
+
+        for entry in entries:
+            self.stdout.write(
+                f"{entry['failed_at']}  {entry['kind']:<12} {entry['task']}{tuple(entry['args'])}\n"
+                f"    {entry['error']}"
+            )
+        self.stdout.write(
+            '\nFix the cause, then requeue with: python manage.py retry_failed_processing --all'
+        )
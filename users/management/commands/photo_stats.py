@@ -1,6 +1,11 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Count, Q
+from datetime import timedelta
+from django.db.models import Avg, Count, F, Max, Q
+from django.utils import timezone
 from photos.models import Batch, Photo
+from photos.originals_cache import originals_cache_stats
+from helpers.metrics import get_metrics
+from helpers.monitoring import get_queue_depths
 
 
 class Command(BaseCommand):
@@ -46,4 +51,37 @@ class Command(BaseCommand):
         
         if empty_batches > 0:
             self.stdout.write(self.style.WARNING(f'\n⚠ Empty Batches: {empty_batches}'))
+        
+        # Upload to sellable latency, per orchestration mode
+        self.stdout.write('\nTime to Sell (last 30 days):')
+        timings = Batch.objects.filter(
+            ready_to_sell_at__gte=timezone.now() - timedelta(days=30),
+            processing_started_at__isnull=False
+        ).annotate(
+            elapsed=F('ready_to_sell_at') - F('processing_started_at')
+        ).values('processing_pipeline').annotate(
+            count=Count('id'),
+            average=Avg('elapsed'),
+            slowest=Max('elapsed')
+        ).order_by('processing_pipeline')
+        for timing in timings:
+            self.stdout.write(
+                f"  {timing['processing_pipeline']}: {timing['count']} batches, "
+                f"avg {timing['average'].total_seconds():.0f}s, max {timing['slowest'].total_seconds():.0f}s"
+            )
+        
+        # Background pipeline counters
+        self.stdout.write('\nPipeline Metrics:')
+        metrics = get_metrics(
+            'zip_build_duplicates_skipped', 'dead_lettered', 'reclaimed_previews', 'reclaimed_zip_builds',
+            'reclaimed_ingests'
+        )
+        metrics.update(originals_cache_stats())
+        for name, value in metrics.items():
+            self.stdout.write(f"  {name}: {value}")
+        
+        # Celery queue backlogs
+        self.stdout.write('\nQueue Depths:')
+        for queue, depth in get_queue_depths().items():
+            self.stdout.write(f"  {queue}: {'unavailable' if depth is None else depth}")
 
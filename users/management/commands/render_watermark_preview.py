@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from photos.previews import WATERMARK_TEXT
+from photos.watermark import render_preview_file
+import time
+
+
+class Command(BaseCommand):
+    help = 'Render a watermarked preview of a local image with the Pillow engine (no network needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str, help='Image file to watermark')
+        parser.add_argument('output', type=str, help='Where to write the JPEG preview')
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.PREVIEW_RENDER_PROCESSES,
+            help='Render processes (0 renders inline)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            source = open(options['source'], 'rb')
+        except OSError as e:
+            raise CommandError(f'Could not open {options["source"]}: {e}')
+
+        start = time.perf_counter()
+        with source:
+            preview = render_preview_file(source, WATERMARK_TEXT, options['processes'])
+        elapsed = time.perf_counter() - start
+
+        with open(options['output'], 'wb') as output:
+            output.write(preview)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Wrote {options["output"]} ({len(preview) / 1024:.0f} KB) in {elapsed * 1000:.0f} ms'
+        ))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from photos.models import Batch, Photo
+from photos.scheduling import requeue_previews
 
 
 class Command(BaseCommand):
@@ -44,10 +45,7 @@ class Command(BaseCommand):
                 preview_status='failed'
             )[:limit]
             
-            count = 0
-            for photo in failed_photos:
-                photo.schedule_preview_generation()
-                count += 1
+            count = requeue_previews(failed_photos)
             
             self.stdout.write(self.style.SUCCESS(
                 f'✓ Queued {count} failed preview(s) for retry'